@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+import sys
+import time
+
+from bot.admission import (
+    MAX_CONCURRENT, MAX_SCAN_WAITING, MAX_SCANS, PRIORITY_LOOKUP, PRIORITY_SCAN, AdmissionController, Overloaded,
+)
+
+# While broad scans keep the admission queue saturated, lookups must be let in
+# within this many milliseconds (worst case) as long as slots are free.
+BUDGET_MS = 50
+DURATION = 5.0
+
+# Far more scans than the scan lane allows, each holding its slot for a while.
+SCAN_JOBS = 40
+SCAN_TIME = 0.5
+
+# Lookups keep arriving, one at a time and quick enough to leave slots free,
+# or in bursts larger than the slots the scans leave, so lookups queue as well.
+LOOKUP_INTERVAL = 0.01
+LOOKUP_TIME = 0.02
+BURST_INTERVAL = 0.2
+BURST_SIZE = 10
+BURST_LOOKUP_TIME = 0.05
+
+async def scan_job(admission: AdmissionController, deadline: float, counts: dict):
+    while time.monotonic() < deadline:
+        try:
+            async with admission.slot(PRIORITY_SCAN):
+                counts["scans"] += 1
+                await asyncio.sleep(SCAN_TIME)
+        except Overloaded:
+            counts["scans_rejected"] += 1
+            await asyncio.sleep(0.01)
+
+async def lookup(admission: AdmissionController, lookup_time: float, waits: list, counts: dict):
+    start = time.perf_counter()
+    try:
+        async with admission.slot(PRIORITY_LOOKUP):
+            waits.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(lookup_time)
+    except Overloaded:
+        counts["lookups_rejected"] += 1
+
+async def watch(admission: AdmissionController, deadline: float, counts: dict):
+    while time.monotonic() < deadline:
+        counts["max_scans_waiting"] = max(counts["max_scans_waiting"], admission.scans_waiting)
+        counts["slots_full"] += admission.slots.locked()
+        await asyncio.sleep(0.001)
+
+async def run(interval: float, burst: int, lookup_time: float) -> tuple:
+    admission = AdmissionController()
+    deadline = time.monotonic() + DURATION
+    counts = {"scans": 0, "scans_rejected": 0, "lookups_rejected": 0, "max_scans_waiting": 0, "slots_full": 0}
+    waits = []
+    scans = [asyncio.create_task(scan_job(admission, deadline, counts)) for _ in range(SCAN_JOBS)]
+    watcher = asyncio.create_task(watch(admission, deadline, counts))
+    # Let the scans fill their lane and their queue before the first lookup arrives.
+    await asyncio.sleep(0.1)
+    lookups = []
+    while time.monotonic() < deadline:
+        # A burst still arrives one lookup at a time, so later ones find the slots taken.
+        for _ in range(burst):
+            lookups.append(asyncio.create_task(lookup(admission, lookup_time, waits, counts)))
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(interval)
+    await asyncio.gather(*lookups, *scans, watcher)
+    return sorted(waits), counts
+
+def report(name: str, waits: list, counts: dict):
+    p99 = waits[int(len(waits) * 0.99)] if waits else 0.0
+    print(f"{name}: {SCAN_JOBS} scan jobs against {MAX_SCANS} scan and {MAX_CONCURRENT} total slots for {DURATION:.0f} s")
+    print(
+        f"  Scans: {counts['scans']} admitted, {counts['scans_rejected']} rejected while busy, "
+        f"at most {counts['max_scans_waiting']} waiting (bound {MAX_SCAN_WAITING})"
+    )
+    print(
+        f"  Lookups: {len(waits)} admitted, {counts['lookups_rejected']} rejected, waited "
+        f"{statistics.median(waits) if waits else 0.0:.1f} ms median, {p99:.1f} ms p99, {max(waits, default=0.0):.1f} ms max"
+    )
+
+def check(waits: list, counts: dict) -> bool:
+    failed = False
+    if not waits or counts["lookups_rejected"]:
+        print("  FAIL: lookups were turned away because of queued scans")
+        failed = True
+    if counts["max_scans_waiting"] > MAX_SCAN_WAITING:
+        print(f"  FAIL: {counts['max_scans_waiting']} scans waited at once, over the bound of {MAX_SCAN_WAITING}")
+        failed = True
+    if not counts["scans"]:
+        print("  FAIL: no scan was ever admitted")
+        failed = True
+    return failed
+
+def main(budget_ms: float) -> int:
+    waits, counts = asyncio.run(run(LOOKUP_INTERVAL, 1, LOOKUP_TIME))
+    report("Free slots", waits, counts)
+    failed = check(waits, counts)
+    if max(waits, default=0.0) > budget_ms:
+        print(f"  FAIL: a lookup waited {max(waits) - budget_ms:.1f} ms over the {budget_ms:.0f} ms budget")
+        failed = True
+
+    waits, counts = asyncio.run(run(BURST_INTERVAL, BURST_SIZE, BURST_LOOKUP_TIME))
+    report("Busy slots", waits, counts)
+    failed |= check(waits, counts)
+    if not counts["slots_full"]:
+        print("  FAIL: every slot was never busy at once, so this case proves nothing")
+        failed = True
+    if not counts["scans_rejected"]:
+        print("  FAIL: the scan queue was never full")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS))
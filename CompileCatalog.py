@@ -0,0 +1,18 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import aiosqlite
+
+from bot.catalog import catalog_path, compile_catalog, write_catalog
+
+# Builds the catalog sidecar ahead of time so the bot's first start after
+# copying over a new items.db doesn't have to.
+async def compile_catalog_file(db_path: Path):
+    async with aiosqlite.connect(db_path) as db:
+        catalog = await compile_catalog(db_path, db)
+    write_catalog(db_path, catalog)
+    print(f"Wrote {catalog_path(db_path)} for items.db {catalog.source_hash}")
+
+if __name__ == "__main__":
+    asyncio.run(compile_catalog_file(Path(sys.argv[1] if len(sys.argv) > 1 else "items.db")))
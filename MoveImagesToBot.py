@@ -1,26 +1,48 @@
 import time
-import aiosqlite
+import sqlite3
 import os
-import asyncio
+import json
+import hashlib
+from multiprocessing import Pool
 from pathlib import Path
 from wand.image import Image
 from katsuba.wad import Archive # type: ignore
 from katsuba.op import * # type: ignore
 
+OUTPUT_DIR = Path.cwd() / "PNG_Images"
+
+# Remembers the hash of each output's source bytes so unchanged images are
+# not converted again, and which texture every .tex points at, keyed by the
+# hash of the .tex itself, so it is only deserialized again after it changes.
+STATE_PATH = OUTPUT_DIR / "extract_state.json"
+STATE_VERSION = 3
+
+ROOT_ARCHIVE = "Root.wad"
+
+# Discord draws embed thumbnails at 80px, so anything past this is wasted upload.
+THUMBNAIL_SIZE = 128
+THUMBNAIL_QUALITY = 80
+
+ARCHIVES = {
+    "|_Shared|WorldData|": "_Shared-WorldData.wad",
+    "|Mob|WorldData|": "Mob-WorldData.wad",
+    "|Player|WorldData|": "Player-WorldData.wad",
+}
+
 class BinDeserializer:
     def __init__(self, types_path: Path):
         opts = SerializerOptions()
         opts.flags = 1
         opts.shallow = False
         opts.skip_unknown_types = True
-        
+
         self.types = TypeList.open(types_path)
 
         self.ser = Serializer(opts, self.types)
 
     def deserialize(self, data):
         return self.ser.deserialize(data)
-    
+
     def deserialize_from_path(self, path: str, archive: Archive):
         try:
             to_return = archive.deserialize(path, self.ser)
@@ -28,134 +50,285 @@ class BinDeserializer:
             to_return = None
         return to_return
 
-async def move_images_to_bot():
-    start = time.time()
-    output_dir = Path.cwd() / "PNG_Images"
-    output_dir.mkdir(parents=True, exist_ok=True)
-    mob_worlddata = Archive.mmap("Mob-WorldData.wad")
-    player_worlddata = Archive.mmap("Player-WorldData.wad")
-    root = Archive.mmap("Root.wad")
-    shared_worlddata = Archive.mmap("_Shared-WorldData.wad")
-    de = BinDeserializer("types.json")
-    async with aiosqlite.connect("items.db") as temp_db:
-        db = await aiosqlite.connect(":memory:")
-        await temp_db.backup(db)
-    async with db.execute(
-        "SELECT * FROM vdfs"
-    ) as cursor:
-        async for row in cursor:
-            if row[2] == "":
-                continue
-            print(f"Processing: {row[2].split('?')[0]}")
-            full_path = row[2]
-            if full_path.startswith("|_Shared|WorldData|"):
-                wad = shared_worlddata
-            elif full_path.startswith("|Mob|WorldData|"):
-                wad = mob_worlddata
-            elif full_path.startswith("|Player|WorldData|"):
-                wad = player_worlddata
-            path = full_path.split("|")[-1]
+class Extractor:
+    def __init__(self, types_path: Path, state: dict):
+        self.archives = {file: Archive.mmap(file) for file in [ROOT_ARCHIVE, *ARCHIVES.values()]}
+        self.de = BinDeserializer(types_path)
+        self.outputs = state["outputs"]
+        self.textures = state["textures"]
+        self.new_textures = {}
+
+        # Index every path once so lookups never have to fail over between archives.
+        self.index = {}
+        for file, archive in self.archives.items():
+            for path in archive:
+                self.index.setdefault(path, []).append(file)
+
+    def locate(self, full_path: str):
+        path = full_path.split("|")[-1].split("?")[0]
+        files = self.index.get(path, [])
+        preferred = ROOT_ARCHIVE
+        for prefix, file in ARCHIVES.items():
+            if full_path.startswith(prefix):
+                preferred = file
+                break
+        if preferred in files:
+            return path, preferred
+        if ROOT_ARCHIVE in files:
+            return path, ROOT_ARCHIVE
+        return path, None
+
+    def read(self, full_path: str):
+        path, file = self.locate(full_path)
+        if file is None:
+            return path, None
+        return path, self.archives[file][path]
+
+    def resolve_texture(self, full_path: str):
+        # A .tex is only a pointer to the real image in m_baseTexture.
+        if full_path.split("?")[0].split(".")[-1] != "tex":
+            return full_path
+        path, data = self.read(full_path)
+        if data is None:
+            return None
+        # A game patch can repoint a .tex, so the memo only holds while its bytes are unchanged.
+        digest = hashlib.sha256(data).hexdigest()
+        memo = self.textures.get(full_path)
+        if memo is not None and memo[0] == digest:
+            return memo[1]
+        base_texture = self.de.deserialize(data[4:])["m_baseTexture"].decode("utf-8")
+        self.textures[full_path] = [digest, base_texture]
+        self.new_textures[full_path] = [digest, base_texture]
+        return base_texture
+
+    def resolve(self, row):
+        # Returns the output name for a row and the full path of the image it shows.
+        if row[1] == "Image":
+            source = self.resolve_texture(row[2])
+            if source is None:
+                return output_name(row[2]), None
+            return output_name(source), source
+        elif row[1] == "VDF":
+            path, data = self.read(row[2])
+            if data is None:
+                return output_name(path), None
+            deserialized_data = self.de.deserialize(data[4:])
+            draw_behavior = None
+            for behavior in deserialized_data["m_behaviors"]:
+                if behavior["m_behaviorName"] == b"DrawBehavior":
+                    draw_behavior = behavior
+                    break
+            if draw_behavior == None:
+                return output_name(path), None
             try:
-                path = path.split("?")[0]
+                image = draw_behavior["m_icons"][0].decode("utf-8")
             except:
-                pass
+                image = row[3]
+            if not image:
+                return output_name(path), None
+            return output_name(path), self.resolve_texture(image)
+        return output_name(row[2]), None
+
+    def convert(self, source: str, names: list):
+        path, data = self.read(source)
+        if data is None:
+            return [(name, "missing", None) for name in names]
+        digest = hashlib.sha256(data).hexdigest()
+        stale = [
+            name for name in names
+            if self.outputs.get(name) != digest
+            or not (OUTPUT_DIR / name).exists()
+            or not (OUTPUT_DIR / thumbnail_name(name)).exists()
+        ]
+        results = [(name, "skipped", digest) for name in names if name not in stale]
+        if not stale:
+            return results
+        with Image(blob=data) as img:
+            img.format = "png"
+            png = img.make_blob()
+            img.transform(resize=f"{THUMBNAIL_SIZE}x{THUMBNAIL_SIZE}>")
+            img.format = "webp"
+            img.compression_quality = THUMBNAIL_QUALITY
+            thumbnail = img.make_blob()
+        for name in stale:
+            write_atomic(OUTPUT_DIR / name, png)
+            write_atomic(OUTPUT_DIR / thumbnail_name(name), thumbnail)
+            results.append((name, "converted", digest))
+        return results
+
+def write_atomic(output_path: Path, data: bytes):
+    # Write to a temporary name first so a crash never leaves a half-written file behind.
+    temp_path = output_path.with_suffix(f".{os.getpid()}.tmp")
+    temp_path.write_bytes(data)
+    os.replace(temp_path, output_path)
+
+def thumbnail_name(name: str) -> str:
+    return f"{name.split('.')[0]}.webp"
+
+def output_name(path: str) -> str:
+    return f"{path.split('|')[-1].split('?')[0].split('/')[-1].split('.')[0]}.png"
+
+_extractor = None
+
+def init_worker(state: dict):
+    global _extractor
+    _extractor = Extractor("types.json", state)
+
+def resolve_rows(rows):
+    results = []
+    for row in rows:
+        try:
+            results.append((*_extractor.resolve(row), None))
+        except Exception as e:
+            results.append((output_name(row[2]), None, str(e)))
+    new_textures = _extractor.new_textures
+    _extractor.new_textures = {}
+    return results, new_textures
+
+def convert_source(task):
+    source, names = task
+    try:
+        return _extractor.convert(source, names)
+    except Exception as e:
+        return [(name, "failed", str(e)) for name in names]
+
+def stream_vdfs(size: int):
+    # Read straight from the file instead of copying the whole database into memory.
+    db = sqlite3.connect("file:items.db?mode=ro", uri=True)
+    try:
+        cursor = db.execute("SELECT * FROM vdfs")
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield [row for row in rows if row[2] != ""]
+    finally:
+        db.close()
+
+def load_state() -> dict:
+    try:
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"version": STATE_VERSION, "outputs": {}, "textures": {}}
+
+def move_images_to_bot():
+    start = time.time()
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    state = load_state()
+    counts = {"converted": 0, "skipped": 0, "missing": 0, "failed": 0}
+    rows = 0
+    sources = {}
+    with Pool(os.cpu_count(), initializer=init_worker, initargs=(state,)) as pool:
+        # First work out which image every row shows, then convert each image
+        # once no matter how many rows share it.
+        for results, new_textures in pool.imap_unordered(resolve_rows, stream_vdfs(64)):
+            state["textures"].update(new_textures)
+            for name, source, error in results:
+                rows += 1
+                if source is not None:
+                    sources.setdefault(source, []).append(name)
+                elif error is not None:
+                    counts["failed"] += 1
+                    print(f"Failed to resolve {name}: {error}")
+                else:
+                    counts["missing"] += 1
+        resolved = time.time()
+
+        outputs = {}
+        for results in pool.imap_unordered(convert_source, sources.items(), chunksize=8):
+            for name, status, detail in results:
+                counts[status] += 1
+                if status == "converted" or status == "skipped":
+                    outputs[name] = detail
+                elif status == "failed":
+                    print(f"Failed to save {name}: {detail}")
+    state["outputs"] = outputs
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    pack_images(OUTPUT_DIR)
+    elapsed = time.time() - start
+    print(
+        f"Done! Processed {rows} rows in {round(elapsed, 2)} seconds "
+        f"({round(rows / max(elapsed, 0.001), 1)} rows/s on {os.cpu_count()} processes, "
+        f"{round(resolved - start, 2)} seconds resolving {len(sources)} unique images): "
+        f"{counts['converted']} converted, {counts['skipped']} unchanged, "
+        f"{counts['missing']} without an image, {counts['failed']} failed."
+    )
+
+def image_dimensions(data: bytes):
+    # PNG keeps its size in the IHDR chunk right after the signature.
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    # WebP stores it in one of three chunk layouts.
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        chunk = data[12:16]
+        if chunk == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8 ":
+            return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+    return 0, 0
+
+def pack_images(output_dir: Path):
+    # Concatenate every PNG and thumbnail into one blob the bot can memory-map,
+    # alongside a manifest of where each image lives, its size, dimensions and
+    # hash. Identical images under different names share a single copy in the pack.
+    manifest_path = output_dir / "images.manifest.json"
+    temp_pack_path = output_dir / f"images.{os.getpid()}.tmp"
+    pack_hash = hashlib.sha256()
+    images = {}
+    offsets = {}
+    offset = 0
+    sizes = {".png": 0, ".webp": 0}
+    with open(temp_pack_path, "wb") as pack:
+        for image_path in sorted([*output_dir.glob("*.png"), *output_dir.glob("*.webp")]):
+            data = image_path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            if digest not in offsets:
+                offsets[digest] = offset
+                pack.write(data)
+                pack_hash.update(data)
+                offset += len(data)
+            width, height = image_dimensions(data)
+            images[image_path.name] = {
+                "offset": offsets[digest],
+                "size": len(data),
+                "width": width,
+                "height": height,
+                "sha256": digest,
+            }
+            sizes[image_path.suffix] += len(data)
+
+    # Every pack is named after its contents and only the manifest says which
+    # one is current, so replacing the manifest is the single step that swaps
+    # packs. A running bot keeps the pack it mapped, which also means Windows
+    # won't let an old pack be deleted until the bot using it stops.
+    pack_digest = pack_hash.hexdigest()
+    pack_path = output_dir / f"images.{pack_digest[:16]}.pack"
+    if pack_path.exists():
+        temp_pack_path.unlink()
+    else:
+        os.replace(temp_pack_path, pack_path)
+    manifest = {"version": 2, "pack": pack_path.name, "pack_size": offset, "pack_sha256": pack_digest, "images": images}
+    write_atomic(manifest_path, json.dumps(manifest).encode("utf-8"))
+    for old_pack_path in output_dir.glob("images*.pack"):
+        if old_pack_path != pack_path:
             try:
-                data = wad[path]
-            except:
-                data = root[path]
-            if row[1] == "Image":
-                if path.split(".")[-1] == "tex":
-                    deserialized_data = de.deserialize(data[4:])
-                    real_image_path = deserialized_data["m_baseTexture"].decode("utf-8")
-                    if real_image_path.startswith("|_Shared|WorldData|"):
-                        wad = shared_worlddata
-                    elif real_image_path.startswith("|Mob|WorldData|"):
-                        wad = mob_worlddata
-                    elif real_image_path.startswith("|Player|WorldData|"):
-                        wad = player_worlddata
-                    path = real_image_path.split("|")[-1]
-                    try:
-                        real_image_data = wad[path]
-                    except:
-                        try:
-                            real_image_data = root[path]
-                        except:
-                            print("No real image path!")
-                            continue
-                    data = real_image_data
-                output_path = output_dir / f"{path.split("/")[-1].split(".")[0]}.png"
-                with Image(blob=data) as img:
-                    try:
-                        img.save(filename=output_path)
-                    except:
-                        print(f"Failed to save {output_path}!")
-            elif row[1] == "VDF":
-                final_path = path
-                deserialized_data = de.deserialize(data[4:])
-                behaviors = deserialized_data["m_behaviors"]
-                draw_behavior = None
-                for behavior in behaviors:
-                    if behavior["m_behaviorName"] == b"DrawBehavior":
-                        draw_behavior = behavior
-                        break
-                if draw_behavior != None:
-                    try:
-                        image = draw_behavior["m_icons"][0].decode("utf-8")
-                    except:
-                        try:
-                            image = row[3]
-                        except:
-                            print("No image path!")
-                            continue
-                    image_split = image.split("/")[-1]
-                    try:
-                        image_split = image_split.split("?")[0]
-                    except:
-                        pass
-                    if image.startswith("|_Shared|WorldData|"):
-                        wad = shared_worlddata
-                    elif image.startswith("|Mob|WorldData|"):
-                        wad = mob_worlddata
-                    elif image.startswith("|Player|WorldData|"):
-                        wad = player_worlddata
-                    path = image.split("|")[-1].split("?")[0]
-                    try:
-                        data = wad[path]
-                    except:
-                        try:
-                            data = root[path]
-                        except:
-                            print("No image path!")
-                            continue
-                    if image_split.split(".")[-1] == "tex":
-                        deserialized_data = de.deserialize(data[4:])
-                        real_image_path = deserialized_data["m_baseTexture"].decode("utf-8")
-                        if real_image_path.startswith("|_Shared|WorldData|"):
-                            wad = shared_worlddata
-                        elif real_image_path.startswith("|Mob|WorldData|"):
-                            wad = mob_worlddata
-                        elif real_image_path.startswith("|Player|WorldData|"):
-                            wad = player_worlddata
-                        path = real_image_path.split("|")[-1]
-                        try:
-                            real_image_data = wad[path]
-                        except:
-                            try:
-                                real_image_data = root[path]
-                            except:
-                                print("No real image path!")
-                                continue
-                    else:
-                        real_image_data = data
-                    output_path = output_dir / f"{final_path.split("/")[-1].split(".")[0]}.png"
-                    with Image(blob=real_image_data) as img:
-                        try:
-                            img.save(filename=output_path)
-                        except:
-                            print(f"Failed to save {output_path}!")
-    await db.close()
-    print(f"Done! Wrote all files in {round(time.time() - start, 2)} seconds.")
-    return
+                old_pack_path.unlink()
+            except OSError:
+                print(f"Could not remove {old_pack_path} yet, it is probably still open in the bot")
+    print(f"Packed {len(images)} images ({len(offsets)} unique, {offset} bytes) into {pack_path}")
+    if sizes[".png"]:
+        print(
+            f"Thumbnails total {sizes['.webp']} bytes against {sizes['.png']} bytes of full-size PNGs "
+            f"({round(100 - sizes['.webp'] * 100 / sizes['.png'], 1)}% smaller uploads)."
+        )
 
 if __name__ == "__main__":
-    asyncio.run(move_images_to_bot())
\ No newline at end of file
+    move_images_to_bot()
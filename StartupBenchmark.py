@@ -0,0 +1,54 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Importing the bot package and every extension must stay under this many
+# milliseconds (the median of several fresh interpreters). Third party
+# libraries the bot can't start without are loaded first and not counted.
+BUDGET_MS = 100
+RUNS = 7
+
+# Only needed once a lookup, render pool or catalog needs them, so importing the
+# bot must not pull them in (even if a library above already has).
+LAZY_MODULES = ["numpy", "fuzzywuzzy", "Levenshtein", "tkinter", "multiprocessing", "jishaku"]
+
+MEASURE = """
+import importlib, json, os, pathlib, sys, time
+import discord, aiosqlite, loguru, pytz
+from discord.ext import commands
+before = set(sys.modules)
+start = time.perf_counter()
+import bot
+for path in sorted(pathlib.Path("bot/extensions").glob("[!_]*.py")):
+    importlib.import_module("bot.extensions." + path.stem)
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({"ms": elapsed, "loaded": [name for name in sys.argv[1:] if name in set(sys.modules) - before]}))
+"""
+
+def measure() -> dict:
+    # A fresh interpreter every time, so nothing is already imported.
+    env = dict(os.environ, HOME_GUILD_ID=os.environ.get("HOME_GUILD_ID") or "0")
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE, *LAZY_MODULES],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(budget_ms: float) -> int:
+    results = [measure() for _ in range(RUNS)]
+    median = statistics.median(result["ms"] for result in results)
+    loaded = sorted({name for result in results for name in result["loaded"]})
+    print(f"Cold start: {median:.1f} ms median over {RUNS} runs (budget {budget_ms:.0f} ms)")
+    failed = False
+    if median > budget_ms:
+        print(f"FAIL: cold start is {median - budget_ms:.1f} ms over budget")
+        failed = True
+    if loaded:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS))
@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 
@@ -11,14 +12,30 @@ ROOT_DIR = Path(__file__).parent.parent
 
 ITEMS_DB = ROOT_DIR / "items.db"
 
+IMAGES_DIR = ROOT_DIR / "PNG_Images"
+
+IMAGE_URL_CACHE = ROOT_DIR / "image_urls.json"
+
+COMMAND_SYNC_STATE = ROOT_DIR / "command_sync.json"
+
+# Owner-defined shorthand names, edited with the alias command.
+ALIASES = ROOT_DIR / "aliases.json"
+
+TYPO_CORRECTIONS = ROOT_DIR / "corrections.json"
+
+# Slash-only deployments drop the message intents and cache. Owner commands
+# are then only available as slash commands in the home guild.
+SLASH_ONLY = os.environ.get("SLASH_ONLY", "").lower() in ("1", "true", "yes")
+
 # Configure Discord gateway intents which should be used by the bot.
 # See https://discordpy.readthedocs.io/en/stable/api.html#discord.Intents
 INTENTS = discord.Intents.none()
 
 INTENTS.emojis = True
 INTENTS.guilds = True
-INTENTS.guild_messages = True
-INTENTS.message_content = True
+if not SLASH_ONLY:
+    INTENTS.guild_messages = True
+    INTENTS.message_content = True
 
 def main():
     logger.remove()
@@ -28,12 +45,18 @@ def main():
 
     bot = TheBot(
         ITEMS_DB,
+        IMAGES_DIR,
+        IMAGE_URL_CACHE,
+        COMMAND_SYNC_STATE,
+        ALIASES,
+        TYPO_CORRECTIONS,
         command_prefix=commands.when_mentioned_or("."),
         case_insensitive=True,
         allowed_mentions=discord.AllowedMentions(
             everyone=False, roles=False, users=False
         ),
-        max_messages=10_000,
+        max_messages=None if SLASH_ONLY else 10_000,
+        member_cache_flags=discord.MemberCacheFlags.none() if SLASH_ONLY else discord.MemberCacheFlags.from_intents(INTENTS),
         intents=INTENTS,
     )
 
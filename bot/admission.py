@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import discord
+
+# Each user may burst a few commands, then gets one every few seconds.
+USER_RATE = 1 / 3
+USER_BURST = 5
+
+# A whole guild shares a larger allowance so one busy server can't starve the rest.
+GUILD_RATE = 2
+GUILD_BURST = 20
+
+# How many commands may run at once, and how many more may wait for a slot.
+MAX_CONCURRENT = 8
+MAX_WAITING = 32
+
+# Broad scans get their own smaller lane so they can never hold every slot,
+# and their own queue so waiting scans never count against lookups.
+MAX_SCANS = 2
+MAX_SCAN_WAITING = 8
+
+# Commands are acknowledged before they queue, so this only bounds how long a user waits.
+MAX_WAIT = 10.0
+
+# Lower runs first. Instant commands answer without deferring and skip the queue entirely.
+PRIORITY_INSTANT = 0
+PRIORITY_LOOKUP = 1
+PRIORITY_SCAN = 2
+
+# Owner commands defer themselves when they need to, so they bypass the queue too.
+INSTANT_COMMANDS = {"help", "sync", "reload", "load", "db", "images", "alias", "stats"}
+SCAN_COMMANDS = {"list", "abilitysearch"}
+
+# Buckets untouched for this long are full again and can be forgotten.
+BUCKET_IDLE = 10 * 60
+
+class Overloaded(Exception):
+    pass
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+def command_priority(command_name: Optional[str]) -> int:
+    if command_name in INSTANT_COMMANDS:
+        return PRIORITY_INSTANT
+    if command_name in SCAN_COMMANDS:
+        return PRIORITY_SCAN
+    return PRIORITY_LOOKUP
+
+class PrioritySemaphore:
+    # Like asyncio.Semaphore, but a released slot goes to the lowest priority
+    # waiter first and to the oldest waiter within a priority.
+    def __init__(self, value: int):
+        self.value = value
+        self.waiters = []
+        self.order = itertools.count()
+
+    def locked(self) -> bool:
+        return self.value == 0
+
+    async def acquire(self, priority: int):
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the waiter gave up.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            future = heapq.heappop(self.waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+class AdmissionController:
+    def __init__(self):
+        self.users: Dict[int, TokenBucket] = {}
+        self.guilds: Dict[int, TokenBucket] = {}
+        self.slots = PrioritySemaphore(MAX_CONCURRENT)
+        self.scans = asyncio.Semaphore(MAX_SCANS)
+        self.waiting = 0
+        self.scans_waiting = 0
+        self.pruned = time.monotonic()
+        self.admitted = 0
+        self.limited = 0
+        self.rejected = 0
+
+    def bucket(self, buckets: Dict[int, TokenBucket], key: int, rate: float, capacity: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def prune(self, now: float):
+        if now - self.pruned < BUCKET_IDLE:
+            return
+        self.pruned = now
+        for buckets in (self.users, self.guilds):
+            for key in [key for key, bucket in buckets.items() if now - bucket.updated > BUCKET_IDLE]:
+                del buckets[key]
+
+    def limit(self, interaction: discord.Interaction) -> Optional[str]:
+        # Returns why the interaction is rate limited, or None if it may go ahead.
+        now = time.monotonic()
+        self.prune(now)
+        user = self.bucket(self.users, interaction.user.id, USER_RATE, USER_BURST)
+        if not user.take(now):
+            self.limited += 1
+            return f"You're sending commands too quickly! Try again in {user.retry_after():.0f} seconds."
+        if interaction.guild_id is not None:
+            guild = self.bucket(self.guilds, interaction.guild_id, GUILD_RATE, GUILD_BURST)
+            if not guild.take(now):
+                self.limited += 1
+                return f"This server is sending commands too quickly! Try again in {guild.retry_after():.0f} seconds."
+        return None
+
+    async def acquire(self, priority: int):
+        if priority != PRIORITY_SCAN:
+            await self.slots.acquire(priority)
+            return
+        await self.scans.acquire()
+        try:
+            await self.slots.acquire(priority)
+        except BaseException:
+            self.scans.release()
+            raise
+
+    def release(self, priority: int):
+        self.slots.release()
+        if priority == PRIORITY_SCAN:
+            self.scans.release()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_LOOKUP):
+        # Reject straight away once the queue is full rather than piling up work.
+        scan = priority == PRIORITY_SCAN
+        if scan:
+            if self.scans_waiting >= MAX_SCAN_WAITING:
+                self.rejected += 1
+                raise Overloaded()
+            self.scans_waiting += 1
+        else:
+            if self.slots.locked() and self.waiting >= MAX_WAITING:
+                self.rejected += 1
+                raise Overloaded()
+            self.waiting += 1
+        try:
+            await asyncio.wait_for(self.acquire(priority), MAX_WAIT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded()
+        finally:
+            if scan:
+                self.scans_waiting -= 1
+            else:
+                self.waiting -= 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.release(priority)
@@ -1,4 +1,7 @@
+import asyncio
+import json
 import os
+from concurrent.futures import BrokenExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -7,46 +10,65 @@ import discord
 from discord.ext import commands
 from loguru import logger
 
-EXTENSIONS = Path(__file__).parent / "extensions"
+from .budget import BudgetedConnection
+from .catalog import file_stat, load_catalog
+from .images import ImageStore, ImageUrlCache
+from .search import Aliases, CorrectionMemo, SearchEngine
+from .singleflight import SingleFlight
+from .snapshot import build_snapshot
+from .tree import AdmissionTree
 
-FIND_ITEM_NAME_QUERY = """
-SELECT locale_en.data FROM items
-INNER JOIN locale_en ON locale_en.id == items.name
-"""
+EXTENSIONS = Path(__file__).parent / "extensions"
 
-FIND_PET_NAME_QUERY = """
-SELECT locale_en.data FROM pets
-INNER JOIN locale_en ON locale_en.id == pets.name
-"""
+# How long a replaced database stays open for lookups that were already using it.
+DB_RETIRE_DELAY = 60
 
-FIND_POWER_NAME_QUERY = """
-SELECT locale_en.data FROM powers
-INNER JOIN locale_en ON locale_en.id == powers.name
-"""
+# How often typo corrections and image URLs learned since the last write are saved.
+FLUSH_INTERVAL = 60
 
-FIND_TALENT_NAME_QUERY = """
-SELECT locale_en.data FROM talents
-INNER JOIN locale_en ON locale_en.id == talents.name
-"""
+# Large enough to map all of items.db, so reads come straight from the OS page cache.
+MMAP_SIZE = 1 << 30
 
-FIND_UNIT_NAME_QUERY = """
-SELECT locale_en.data FROM units
-INNER JOIN locale_en ON locale_en.id == units.name
-"""
+async def connect_read_only(db_path: Path, immutable: bool = False) -> aiosqlite.Connection:
+    # Immutable skips locking and change detection entirely, so items.db must
+    # never be modified in place while the bot has it open.
+    uri = f"{db_path.resolve().as_uri()}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    db = await aiosqlite.connect(uri, uri=True)
+    await db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return db
 
 class TheBot(commands.Bot):
-    def __init__(self, db_path: Path, **kwargs):
-        super().__init__(**kwargs)
+    def __init__(self, db_path: Path, images_dir: Path, image_url_cache_path: Path, sync_state_path: Path, aliases_path: Path, corrections_path: Path, **kwargs):
+        super().__init__(tree_cls=AdmissionTree, **kwargs)
 
         self.ready_once = False
         self.db_path = db_path
         self.db = None
+        self.scan_db = None
+        self.db_version = 0
+        self.catalog = None
+        self.search = None
+        self.aliases = Aliases(aliases_path)
+        self.aliases.load()
+        self.corrections = CorrectionMemo(corrections_path)
+        self.flush_task = None
+        self.retiring = set()
         self.item_list = []
         self.pet_list = []
         self.power_list = []
         self.talent_list = []
         self.unit_list = []
         self.uptime = datetime.now()
+        self.single_flight = SingleFlight()
+        self.render = None
+        self.images = ImageStore(images_dir)
+        self.images.load()
+        self.image_urls = ImageUrlCache(image_url_cache_path)
+        self.image_urls.key = self.images.cache_key
+        self.image_urls.load()
+        self.sync_state_path = sync_state_path
 
     async def on_ready(self):
         
@@ -54,56 +76,154 @@ class TheBot(commands.Bot):
             return
         self.ready_once = True
         
-        # If we are not connected yet, connect to db.
-        async with aiosqlite.connect(self.db_path) as db:
-            self.db = await aiosqlite.connect(":memory:")
-            await db.backup(self.db)
+        await self.load_db()
+        self.flush_task = asyncio.create_task(self.flush_caches())
 
-        # Put lists of things into the bot.
-        async with self.db.execute(FIND_ITEM_NAME_QUERY) as cursor:
-            tuple_item_list = await cursor.fetchall()
+        # Optionally build embeds in worker processes to keep the event loop free.
+        render_workers = int(os.environ.get("RENDER_WORKERS") or 0)
+        if render_workers > 0:
+            from .render import RenderPool
+            self.render = RenderPool(self.db_path, self.images, self.aliases, self.corrections, render_workers)
+            self.render.start()
 
-        for i in tuple_item_list:
-            if i[0] not in self.item_list:
-                self.item_list.append(i[0])
+        # Load required bot extensions. Jishaku is opt-in, and only works
+        # through prefix commands, which slash-only deployments can't receive.
+        if self.intents.message_content and os.environ.get("LOAD_JISHAKU", "").lower() in ("1", "true", "yes"):
+            await self.load_extension("jishaku")
+        ext_count = await self.load_extensions_from_dir(EXTENSIONS)
+        self.home_guild = os.environ["HOME_GUILD_ID"]
 
-        async with self.db.execute(FIND_PET_NAME_QUERY) as cursor:
-            tuple_pet_list = await cursor.fetchall()
+        # Optionally seed thumbnail URLs through a channel only the bot posts in.
+        cache_channel_id = os.environ.get("IMAGE_CACHE_CHANNEL_ID")
+        if cache_channel_id:
+            self.image_urls.channel = self.get_channel(int(cache_channel_id))
 
-        for i in tuple_pet_list:
-            if i[0] not in self.pet_list:
-                self.pet_list.append(i[0])
-        
-        async with self.db.execute(FIND_POWER_NAME_QUERY) as cursor:
-            tuple_power_list = await cursor.fetchall()
+        await self.sync_commands()
+        # Log information about the user.
+        logger.info(f"Logged in as {self.user}")
+        logger.info(f"Running with {ext_count} extensions")
 
-        for i in tuple_power_list:
-            if i[0] not in self.power_list:
-                self.power_list.append(i[0])
-        
-        async with self.db.execute(FIND_TALENT_NAME_QUERY) as cursor:
-            tuple_talent_list = await cursor.fetchall()
+    async def sync_commands(self, force: bool = False) -> int:
+        # Owner commands are registered to the home guild only, so it syncs separately.
+        home_guild = discord.Object(int(self.home_guild))
+        guilds = [None, home_guild]
 
-        for i in tuple_talent_list:
-            if i[0] not in self.talent_list:
-                self.talent_list.append(i[0])
-        
-        async with self.db.execute(FIND_UNIT_NAME_QUERY) as cursor:
-            tuple_unit_list = await cursor.fetchall()
+        # During development, register everything to the home guild only,
+        # where changes show up instantly and never touch the global commands.
+        if os.environ.get("SYNC_HOME_GUILD_ONLY", "").lower() in ("1", "true", "yes"):
+            self.tree.copy_global_to(guild=home_guild)
+            guilds = [home_guild]
 
-        for i in tuple_unit_list:
-            if i[0] not in self.unit_list:
-                self.unit_list.append(i[0])
+        # Syncing is a slow, rate limited call, so skip it when nothing changed since last time.
+        state = self.load_sync_state()
+        synced = 0
+        for guild in guilds:
+            key = f"{self.application_id}:{guild.id if guild else 'global'}"
+            schema_hash = self.tree.schema_hash(guild)
+            if not force and state.get(key) == schema_hash:
+                logger.info("Commands for {} unchanged, skipping sync", key)
+                continue
+            await self.tree.sync(guild=guild)
+            state[key] = schema_hash
+            synced += 1
+        self.save_sync_state(state)
+        return synced
 
-        # Load required bot extensions.
-        await self.load_extension("jishaku")
-        ext_count = await self.load_extensions_from_dir(EXTENSIONS)
-        self.home_guild = os.environ["HOME_GUILD_ID"]
+    def load_sync_state(self) -> dict:
+        try:
+            with open(self.sync_state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.exception("Failed loading command sync state, syncing everything")
+            return {}
 
-        await self.tree.sync()
-        # Log information about the user.
-        logger.info(f"Logged in as {self.user}")
-        logger.info(f"Running with {ext_count} extensions")
+    def save_sync_state(self, state: dict):
+        try:
+            with open(self.sync_state_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError:
+            logger.exception("Failed saving command sync state")
+
+    async def load_db(self):
+        # Either copy the database into memory, copy only the tables and strings
+        # the cogs use, or map the file read-only so its pages live in the OS
+        # page cache and are shared between processes. Then load everything
+        # derived from it from the catalog sidecar, compiling that only when
+        # items.db changed.
+        mode = os.environ.get("DB_MODE", "memory").lower()
+        mmap = mode == "mmap"
+
+        # Broad scans and fuzzy fallbacks read the file through their own
+        # connection, so they queue on a different thread than exact lookups
+        # and can be cut off when they run over budget. It is opened first and
+        # keeps the file it opened, so scans read the same items.db the lookups
+        # were copied from even after a new one is moved over it. It is never
+        # immutable, even in mmap mode, so it notices the file being written over.
+        while True:
+            stat = file_stat(self.db_path)
+            scan_db = await connect_read_only(self.db_path)
+            if mmap:
+                new_db = await connect_read_only(self.db_path, immutable=True)
+            elif mode == "pruned":
+                new_db = await build_snapshot(self.db_path)
+            else:
+                new_db = await aiosqlite.connect(":memory:")
+                await scan_db.backup(new_db)
+            if file_stat(self.db_path) == stat:
+                break
+            logger.warning("items.db changed while loading it, loading it again")
+            await new_db.close()
+            await scan_db.close()
+        new_scan_db = BudgetedConnection(scan_db)
+        await new_scan_db.pin()
+
+        catalog = await load_catalog(self.db_path, new_db)
+        self.item_list = catalog.item_list
+        self.pet_list = catalog.pet_list
+        self.power_list = catalog.power_list
+        self.talent_list = catalog.talent_list
+        self.unit_list = catalog.unit_list
+        # Name lookups resolve against the catalog in memory rather than the database.
+        self.corrections.load(catalog.source_hash)
+        search = SearchEngine(catalog, self.aliases, self.corrections)
+
+        if self.db is not None:
+            self.retire_db(self.db, self.scan_db)
+        self.db = new_db
+        self.catalog = catalog
+        self.search = search
+        self.scan_db = new_scan_db
+        # Results computed against an older snapshot must not be shared with new requests.
+        self.db_version += 1
+        if self.render is not None:
+            self.render.restart()
+
+    async def flush_caches(self):
+        # Batched, so a burst of typos or uploads costs one write rather than one each.
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.corrections.flush()
+            await self.image_urls.flush()
+
+    def retire_db(self, *dbs):
+        async def close_later():
+            await asyncio.sleep(DB_RETIRE_DELAY)
+            for db in dbs:
+                await db.close()
+        task = asyncio.create_task(close_later())
+        self.retiring.add(task)
+        task.add_done_callback(self.retiring.discard)
+
+    async def render_embeds(self, method, *args):
+        if self.render is not None and self.render.can_render(method):
+            try:
+                return await self.render.render(method, *args)
+            except BrokenExecutor:
+                logger.exception("Render worker died, rendering on the event loop instead")
+                self.render.restart()
+        return await method(*args)
 
     async def load_extensions_from_dir(self, path: Path) -> int:
         if not path.is_dir():
@@ -140,7 +260,15 @@ class TheBot(commands.Bot):
             await self.invoke(ctx)
 
     async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.corrections.flush()
+        await self.image_urls.flush()
         await self.db.close()
+        await self.scan_db.close()
+        self.images.close()
+        if self.render is not None:
+            self.render.close()
 
     def run(self):
         super().run(os.environ["DISCORD_TOKEN"])
@@ -0,0 +1,69 @@
+import asyncio
+import sqlite3
+import time
+from typing import List, Optional
+
+import aiosqlite
+
+# No single scan may hold the scan connection for longer than this.
+SCAN_TIME_BUDGET = 3.0
+
+# How many SQLite VM instructions run between deadline checks.
+PROGRESS_STEPS = 10_000
+
+# List results beyond this are too many to page through anyway.
+MAX_LIST_ROWS = 1000
+
+class QueryTooBroad(Exception):
+    pass
+
+class SnapshotChanged(Exception):
+    pass
+
+class BudgetedConnection:
+    # Wraps the scan connection so every query runs against a deadline and,
+    # optionally, a row limit, instead of stalling everyone queued behind it.
+    def __init__(self, db: aiosqlite.Connection):
+        self.db = db
+        # The progress handler belongs to the connection, so only one query may own it at a time.
+        self.lock = asyncio.Lock()
+        self.interrupted = 0
+        self.truncated = 0
+        self.data_version = None
+
+    async def pin(self):
+        # Remember which version of the file the lookups were loaded from.
+        async with self.db.execute("PRAGMA data_version") as cursor:
+            self.data_version = (await cursor.fetchone())[0]
+
+    async def fetch(self, query: str, args: tuple = (), max_rows: Optional[int] = None, seconds: float = SCAN_TIME_BUDGET) -> List[tuple]:
+        async with self.lock:
+            # items.db was written over in place, so scans would no longer match
+            # the lookups. Refuse them until the database is reloaded.
+            if self.data_version is not None:
+                async with self.db.execute("PRAGMA data_version") as cursor:
+                    if (await cursor.fetchone())[0] != self.data_version:
+                        raise SnapshotChanged("items.db changed since it was loaded")
+            deadline = time.monotonic() + seconds
+            await self.db.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+            try:
+                async with self.db.execute(query, args) as cursor:
+                    if max_rows is None:
+                        rows = await cursor.fetchall()
+                    else:
+                        rows = await cursor.fetchmany(max_rows + 1)
+            except sqlite3.OperationalError as e:
+                if "interrupted" not in str(e):
+                    raise
+                self.interrupted += 1
+                raise QueryTooBroad(f"Query took longer than {seconds} seconds")
+            finally:
+                await self.db.set_progress_handler(None, PROGRESS_STEPS)
+
+        if max_rows is not None and len(rows) > max_rows:
+            self.truncated += 1
+            raise QueryTooBroad(f"More than {max_rows} rows matched")
+        return rows
+
+    async def close(self):
+        await self.db.close()
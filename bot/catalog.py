@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+from loguru import logger
+
+from . import database
+from .records import ItemRecord, PetRecord, PowerRecord, TalentRecord, UnitRecord, record_names
+from .stats import StatMatrix
+
+# Bump whenever the fields below change so stale sidecars are rebuilt instead of misread.
+CATALOG_VERSION = 4
+
+# Everything the bot derives from items.db, tagged with the hash of the
+# database it was compiled from.
+class Catalog:
+    def __init__(self, source_hash: str, source_stat: Tuple[int, int]):
+        self.version = CATALOG_VERSION
+        self.source_hash = source_hash
+        self.source_stat = source_stat
+        self.items: Dict[int, ItemRecord] = {}
+        self.pets: Dict[int, PetRecord] = {}
+        self.powers: Dict[int, PowerRecord] = {}
+        self.talents: Dict[int, TalentRecord] = {}
+        self.units: Dict[int, UnitRecord] = {}
+        self.item_list: List[str] = []
+        self.pet_list: List[str] = []
+        self.power_list: List[str] = []
+        self.talent_list: List[str] = []
+        self.unit_list: List[str] = []
+        self.item_stats: Optional[StatMatrix] = None
+
+def catalog_path(db_path: Path) -> Path:
+    return db_path.with_suffix(".catalog")
+
+def file_stat(path: Path) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_catalog(db_path: Path) -> Optional[Catalog]:
+    path = catalog_path(db_path)
+    try:
+        with open(path, "rb") as f:
+            # The version is pickled on its own first, so a stale catalog is
+            # recognised before its records, whose fields may have changed, are loaded.
+            if pickle.load(f) != CATALOG_VERSION:
+                return None
+            catalog = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Failed reading catalog {}, rebuilding it", path)
+        return None
+
+    # An untouched database can't have changed, so skip hashing it.
+    stat = file_stat(db_path)
+    if catalog.source_stat == stat:
+        return catalog
+    if catalog.source_hash != file_hash(db_path):
+        return None
+    # Same contents under a new timestamp, e.g. after copying items.db over again.
+    catalog.source_stat = stat
+    write_catalog(db_path, catalog)
+    return catalog
+
+def write_catalog(db_path: Path, catalog: Catalog):
+    path = catalog_path(db_path)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            pickle.dump(catalog.version, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError:
+        logger.exception("Failed writing catalog {}", path)
+
+async def fetch_locale(db: aiosqlite.Connection, ids: Iterable[int]) -> Dict[int, str]:
+    locale = {}
+    ids = list({id for id in ids if id is not None})
+    for chunk in database.sql_chunked(ids, 900):  # Stay under SQLite's limit
+        query = f"SELECT id, data FROM locale_en WHERE id IN ({database._make_placeholders(len(chunk))})"
+        async with db.execute(query, chunk) as cursor:
+            async for row in cursor:
+                locale[row[0]] = row[1]
+    return locale
+
+async def fetch_records(db: aiosqlite.Connection, table: str, record, locale_columns: Tuple[int, ...] = (1,), columns: str = "*") -> Dict:
+    async with db.execute(f"SELECT {columns} FROM {table}") as cursor:
+        rows = await cursor.fetchall()
+    locale = await fetch_locale(db, (row[column] for row in rows for column in locale_columns))
+    return {row[0]: record.from_row(row, locale) for row in rows}
+
+async def compile_catalog(db_path: Path, db: aiosqlite.Connection) -> Catalog:
+    # Read the stamp first so a database replaced mid-compile is never marked as current.
+    source_stat = file_stat(db_path)
+    catalog = Catalog(await asyncio.to_thread(file_hash, db_path), source_stat)
+    catalog.items = await fetch_records(db, "items", ItemRecord)
+    catalog.pets = await fetch_records(db, "pets", PetRecord)
+    catalog.powers = await fetch_records(db, "powers", PowerRecord)
+    catalog.talents = await fetch_records(db, "talents", TalentRecord)
+    # Units carry a translated title next to their name.
+    catalog.units = await fetch_records(db, "units", UnitRecord, (1, 4), "*, units.kind")
+    # Read by position, like the item embeds, since that is all the cogs rely on.
+    async with db.execute("SELECT * FROM item_stats") as cursor:
+        catalog.item_stats = StatMatrix(catalog.items, await cursor.fetchall())
+    catalog.item_list = record_names(catalog.items)
+    catalog.pet_list = record_names(catalog.pets)
+    catalog.power_list = record_names(catalog.powers)
+    catalog.talent_list = record_names(catalog.talents)
+    catalog.unit_list = record_names(catalog.units)
+    return catalog
+
+async def load_catalog(db_path: Path, db: aiosqlite.Connection) -> Catalog:
+    catalog = await asyncio.to_thread(read_catalog, db_path)
+    if catalog is not None:
+        logger.info("Loaded catalog for items.db {}", catalog.source_hash[:12])
+        return catalog
+
+    catalog = await compile_catalog(db_path, db)
+    await asyncio.to_thread(write_catalog, db_path, catalog)
+    logger.info("Compiled catalog for items.db {}", catalog.source_hash[:12])
+    return catalog
@@ -1,11 +1,5 @@
-from enum import IntFlag, Enum
-from struct import unpack
-from tkinter.font import names
-from typing import Tuple, List
-from dataclasses import dataclass
-from random import choice
-from loguru import logger
-import math
+from enum import IntFlag
+from typing import List
 
 import discord
 
@@ -306,6 +300,16 @@ def translate_school(school: int) -> discord.PartialEmoji:
 def make_school_color(school: str) -> discord.Color:
     return _SCHOOL_COLORS[_SCHOOLS_STR.index(school)]
 
+_fuzz = None
+
+def fuzzy_score(name: str, candidate: str) -> int:
+    # fuzzywuzzy is only imported once a lookup actually falls back to fuzzy matching.
+    global _fuzz
+    if _fuzz is None:
+        from fuzzywuzzy import fuzz
+        _fuzz = fuzz
+    return _fuzz.token_set_ratio(name, candidate) + _fuzz.ratio(name, candidate)
+
 async def faction_has_names(db, faction: int) -> bool:
     has_names = False
     async with db.execute(
@@ -319,21 +323,21 @@ async def faction_has_names(db, faction: int) -> bool:
 async def translate_name(db, id: int) -> str:
     name = ""
     async with db.execute(
-        "SELECT * FROM locale_en WHERE id == ?", (id,)
+        "SELECT data FROM locale_en WHERE id == ?", (id,)
     ) as cursor:
         async for row in cursor:
-            name = row[1]
+            name = row[0]
     
     return name
 
 async def translate_talent_name(db, id: int) -> str:
     name = ""
     async with db.execute(
-        "SELECT * FROM talents WHERE id == ?", (id,)
+        "SELECT name, real_name FROM talents WHERE id == ?", (id,)
     ) as cursor:
         async for row in cursor:
-            name = await translate_name(db, row[1])
-            object_name = row[2].decode("utf-8")
+            name = await translate_name(db, row[0])
+            object_name = row[1].decode("utf-8")
             if name == None:
                 name = object_name
     return name, object_name
@@ -342,11 +346,11 @@ async def translate_power_name(db, id: int) -> str:
     name = ""
     object_name = ""
     async with db.execute(
-        "SELECT * FROM powers WHERE id == ?", (id,)
+        "SELECT name, real_name FROM powers WHERE id == ?", (id,)
     ) as cursor:
         async for row in cursor:
-            name = await translate_name(db, row[1])
-            object_name = row[2].decode("utf-8")
+            name = await translate_name(db, row[0])
+            object_name = row[1].decode("utf-8")
             if name == None:
                 name = object_name
     return name, object_name
@@ -354,16 +358,19 @@ async def translate_power_name(db, id: int) -> str:
 async def translate_unit_name(db, id: int) -> str:
     name = ""
     async with db.execute(
-        "SELECT * FROM units WHERE id == ?", (id,)
+        "SELECT name, real_name FROM units WHERE id == ?", (id,)
     ) as cursor:
         async for row in cursor:
-            name = await translate_name(db, row[1])
-            object_name = row[2].decode("utf-8")
+            name = await translate_name(db, row[0])
+            object_name = row[1].decode("utf-8")
             if name == None:
                 name = object_name
     return name, object_name
 
 async def generate_random_name(db, faction: int, gender: str) -> str:
+    # Only needed when a random name is asked for, so kept off the startup import path.
+    from random import choice
+
     first_names = []
     last_names = []
     articles = []
@@ -1,6 +1,4 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import itemgetter
 
 import discord
 from discord import app_commands
@@ -14,6 +12,7 @@ HELP_DESCRIPTION = """
 **/item find**: Finds the item's ingame stats. Parameters: Name, Class, Kind, Level\n
 **/item list**: Finds a list of items containing a given string. Parameters: Name, Class, Kind, Level\n
 **/item abilitysearch**: Searches for items that have a given ability. Parameters: Name, School, Kind, Level\n
+**/item top**: Lists the items that give the most of a stat. Parameters: Stat, Class, Kind, Level, Count\n
 **/unit find**: Finds the unit's ingame stats. Parameters: Name, Class, Kind\n
 **/unit list**: Finds a list of units containing a given string. Parameters: Name, Class, Kind\n
 **/unit calc**: Calculates the stats of a unit at a given level. Parameters: Name, Level, Class, Kind\n
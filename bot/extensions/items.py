@@ -1,64 +1,22 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
-import re
-import os
-from random import choice
 
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
 from loguru import logger
 
-from .talents import Talents
-from .powers import Powers
-from .. import TheBot, database, emojis
+from .. import TheBot, budget, database, emojis, respond
 from ..menus import ItemView
-
-FIND_ITEM_QUERY = """
-SELECT * FROM items
-LEFT JOIN locale_en ON locale_en.id == items.name
-WHERE locale_en.data == ? COLLATE NOCASE
-"""
-
-FIND_OBJECT_NAME_QUERY = """
-SELECT * FROM items
-WHERE items.real_name == ? COLLATE NOCASE
-"""
+from ..records import ItemRecord, find_records
+from ..search import closest_name, item_facets, normalize
+from ..stats import format_stat
 
 FIND_ITEM_STATS_QUERY = """
 SELECT * FROM item_stats WHERE item_stats.item == ?
 """
 
-FIND_ITEMS_WITH_FILTER_QUERY = """
-SELECT * FROM items
-INNER JOIN locale_en ON locale_en.id == items.name
-WHERE locale_en.data == ? COLLATE NOCASE
-AND (? = 'All' OR items.equip_school = ?)
-AND (? = 'Any' OR items.item_type = ?)
-AND (? = -1 OR items.equip_level >= ?)
-COLLATE NOCASE
-"""
-
-FIND_ITEM_CONTAIN_STRING_QUERY = """
-SELECT * FROM items
-LEFT JOIN locale_en ON locale_en.id == items.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-"""
-
-FIND_ITEMS_CONTAIN_STRING_WITH_FILTER_QUERY = """
-SELECT * FROM items
-INNER JOIN locale_en ON locale_en.id == items.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-AND (? = 'All' OR items.equip_school = ?)
-AND (? = 'Any' OR items.item_type = ?)
-AND (? = -1 OR items.equip_level >= ?)
-COLLATE NOCASE
-"""
-
 FIND_ITEM_WITH_TALENT_QUERY = """
-SELECT * FROM items
+SELECT items.id FROM items
 INNER JOIN item_stats ON item_stats.item == items.id
 INNER JOIN talents ON talents.id == item_stats.stat
 INNER JOIN locale_en ON locale_en.id == talents.name
@@ -66,125 +24,49 @@ WHERE locale_en.data == ? COLLATE NOCASE
 """
 
 FIND_ITEM_WITH_POWER_QUERY = """
-SELECT * FROM items
+SELECT items.id FROM items
 INNER JOIN item_stats ON item_stats.item == items.id
 INNER JOIN powers ON powers.id == item_stats.stat
 INNER JOIN locale_en ON locale_en.id == powers.name
 WHERE locale_en.data == ? COLLATE NOCASE
 """
 
-FIND_ITEMS_WITH_TALENT_AND_FILTER_QUERY = """
-SELECT * FROM items
-INNER JOIN item_stats ON item_stats.item == items.id
-INNER JOIN talents ON talents.id == item_stats.stat
-INNER JOIN locale_en ON locale_en.id == talents.name
-WHERE locale_en.data == ? COLLATE NOCASE
-AND (? = 'All' OR items.equip_school = ?)
-AND (? = 'Any' OR items.item_type = ?)
-AND (? = -1 OR items.equip_level >= ?)
-"""
-
-FIND_ITEMS_WITH_POWER_AND_FILTER_QUERY = """
-SELECT * FROM items
-INNER JOIN item_stats ON item_stats.item == items.id
-INNER JOIN powers ON powers.id == item_stats.stat
-INNER JOIN locale_en ON locale_en.id == powers.name
-WHERE locale_en.data == ? COLLATE NOCASE
-AND (? = 'All' OR items.equip_school = ?)
-AND (? = 'Any' OR items.item_type = ?)
-AND (? = -1 OR items.equip_level >= ?)
-"""
-
-FIND_ITEMS_WITH_FILTER_PLACEHOLDER_QUERY = """
-SELECT * FROM items
-INNER JOIN locale_en ON locale_en.id == items.name
-WHERE locale_en.data COLLATE NOCASE IN ({placeholders})
-AND (? = 'All' OR items.equip_school = ?)
-AND (? = 'Any' OR items.item_type = ?)
-AND (? = -1 OR items.equip_level >= ?)
-COLLATE NOCASE
-"""
-
 class Items(commands.GroupCog, name="item"):
     def __init__(self, bot: TheBot):
         self.bot = bot
     
-    async def fetch_item(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_ITEM_QUERY, (name,)) as cursor:
-            return await cursor.fetchall()
-
-    async def fetch_object_name(self, name: str) -> List[tuple]:
-        name_bytes = name.encode('utf-8')
-        async with self.bot.db.execute(FIND_OBJECT_NAME_QUERY, (name_bytes,)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_item_list(self, name: str) -> List[ItemRecord]:
+        return self.bot.search.contains("items", name)
     
-    async def fetch_item_with_filter(self, name: str, school: str, kind: str, level: int):
-        async with self.bot.db.execute(FIND_ITEMS_WITH_FILTER_QUERY, (name,school,school,kind,kind,level,level)) as cursor:
-            return await cursor.fetchall()
-    
-    async def fetch_item_list(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_ITEM_CONTAIN_STRING_QUERY, (name.lower(),)) as cursor:
-            return await cursor.fetchall()
-    
-    async def fetch_item_list_with_filter(self, name: str, school: str, kind: str, level: int):
-        async with self.bot.db.execute(FIND_ITEMS_CONTAIN_STRING_WITH_FILTER_QUERY, (name.lower(),school,school,kind,kind,level,level)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_item_list_with_filter(self, name: str, school: str, kind: str, level: int) -> List[ItemRecord]:
+        return self.bot.search.contains("items", name, item_facets(school, kind, level))
     
     async def fetch_item_stats(self, id: str) -> List[tuple]:
         async with self.bot.db.execute(FIND_ITEM_STATS_QUERY, (id,)) as cursor:
             return await cursor.fetchall()
     
-    async def fetch_item_ability_list(self, ability: str) -> List[tuple]:
+    async def fetch_item_ability_list(self, ability: str) -> List[ItemRecord]:
         rows = []
-        async with self.bot.db.execute(FIND_ITEM_WITH_TALENT_QUERY, (ability,)) as cursor:
-            rows = rows + await cursor.fetchall()
-        async with self.bot.db.execute(FIND_ITEM_WITH_POWER_QUERY, (ability,)) as cursor:
-            rows = rows + await cursor.fetchall()
-        return rows
+        rows = rows + await self.bot.scan_db.fetch(FIND_ITEM_WITH_TALENT_QUERY, (ability,), max_rows=budget.MAX_LIST_ROWS)
+        rows = rows + await self.bot.scan_db.fetch(FIND_ITEM_WITH_POWER_QUERY, (ability,), max_rows=budget.MAX_LIST_ROWS)
+        return find_records(self.bot.catalog.items, rows)
     
-    async def fetch_item_ability_list_with_filter(self, ability: str, school: str, kind: str, level: int) -> List[tuple]:
+    async def fetch_item_ability_list_with_filter(self, ability: str, school: str, kind: str, level: int) -> List[ItemRecord]:
+        # Every item with the ability, narrowed by the filter bitsets afterwards.
         rows = []
-        async with self.bot.db.execute(FIND_ITEMS_WITH_TALENT_AND_FILTER_QUERY, (ability,school,school,kind,kind,level,level)) as cursor:
-            rows = rows + await cursor.fetchall()
-        async with self.bot.db.execute(FIND_ITEMS_WITH_POWER_AND_FILTER_QUERY, (ability,school,school,kind,kind,level,level)) as cursor:
-            rows = rows + await cursor.fetchall()
-        return rows
+        rows = rows + await self.bot.scan_db.fetch(FIND_ITEM_WITH_TALENT_QUERY, (ability,), max_rows=budget.MAX_LIST_ROWS)
+        rows = rows + await self.bot.scan_db.fetch(FIND_ITEM_WITH_POWER_QUERY, (ability,), max_rows=budget.MAX_LIST_ROWS)
+        return self.bot.search.restrict("items", find_records(self.bot.catalog.items, rows), item_facets(school, kind, level))
     
-    async def fetch_item_filter_list(self, items, school: str, kind: str, level: int) -> List[tuple]:
-        if isinstance(items, str):
-            items = [items]
+    async def build_item_embed(self, item: ItemRecord):
+        item_id = item.id
+        real_name = item.real_name
 
-        results = []
-        for chunk in database.sql_chunked(items, 900):  # Stay under SQLite's limit
-            placeholders = database._make_placeholders(len(chunk))
-            query = FIND_ITEMS_WITH_FILTER_PLACEHOLDER_QUERY.format(placeholders=placeholders)
-
-            args = (
-                *chunk,
-                school, school,
-                kind, kind,
-                level, level
-            )
-
-            async with self.bot.db.execute(query, args) as cursor:
-                rows = await cursor.fetchall()
-
-            results.extend(rows)
-
-        return results
-        
-    async def build_item_embed(self, row):
-        item_id = row[0]
-        real_name = row[2].decode("utf-8")
-
-        item_name = await database.translate_name(self.bot.db, row[1])
-        try:
-            item_image = row[3].decode("utf-8")
-        except:
-            item_image = ""
-        item_type = row[4]
-        item_flags = row[5]
-        item_reqs = [row[6], row[7], row[8], row[9]]
+        item_name = item.name
+        item_image = item.image or ""
+        item_type = item.kind
+        item_flags = item.flags
+        item_reqs = [item.school, item.level, item.talent_req, item.talent_req_rank]
 
         stats = await self.fetch_item_stats(item_id)
 
@@ -255,16 +137,7 @@ class Items(commands.GroupCog, name="item"):
 
         discord_file = None
         if item_image:
-            try:
-                image_name = item_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, item_image)
         
         if requirement_string != "":
             try:
@@ -289,67 +162,53 @@ class Items(commands.GroupCog, name="item"):
         level: Optional[int] = -1,
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested item '{}'", interaction.user.name, name)
         else:
             logger.info("{} requested item '{}' in channel #{} of {}", interaction.user.name, name, interaction.channel.name, interaction.guild.name)
         
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No items with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        
-        else:
-            if school != "All" or kind != "Any" or level != -1:
-                rows = await self.fetch_item_with_filter(name, school, kind, level)
-            else:
-                rows = await self.fetch_item(name)
-                if not rows:
-                    mount_name = f"{name} (PERM)"
-                    rows = await self.fetch_item(mount_name)
-            if not rows:
-                filtered_rows = await self.fetch_item_filter_list(items=self.bot.item_list, school=school, kind=kind, level=level)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                if school != "All" or kind != "Any" or level != -1:
-                    rows = await self.fetch_item_with_filter(name=closest_rows[0][-1], school=school, kind=kind, level=level)
-                else:
-                    rows = await self.fetch_item(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-        
-        if rows:
-            embeds = [await self.build_item_embed(row) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+        # Identical lookups running at the same time share one search and render.
+        key = ("item find", name, school, kind, level, use_object_name, self.bot.db_version)
+        embeds = await self.bot.single_flight.do(key, lambda: self.bot.render_embeds(self.find_embeds, name, school, kind, level, use_object_name))
+
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             await view.start(interaction)
-        elif not use_object_name:
+        elif use_object_name:
+            embed = discord.Embed(description=f"No items with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No items with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    async def find_embeds(self, name: str, school: str, kind: str, level: int, use_object_name: bool):
+        rows, stage = self.bot.search.find("items", name, item_facets(school, kind, level), use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_item_embed(row) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
     
-    async def build_list_embed(self, rows: List[tuple], name: str, list_type: str):
+    async def build_list_embed(self, rows: List[ItemRecord], name: str, list_type: str):
         desc_strings = []
         desc_index = 0
         counts = {}
         obj_names_done = []
         desc_strings.append("")
         for row in rows:
-            real_name = row[2].decode("utf-8")
-            item_name = await database.translate_name(self.bot.db, row[1])
-            item_type = row[4]
-            item_class = row[6]
+            real_name = row.real_name
+            item_name = row.name
+            item_type = row.kind
+            item_class = row.school
             if real_name in obj_names_done:
                 continue
             else:
                 obj_names_done.append(real_name)
             counts.update({item_name: 0})
             for new_row in rows:
-                if new_row[1] == row[1] and new_row[4] == row[4] and new_row[6] == row[6] and (counts[item_name] == 0 or new_row[2] != row[2]):
+                if new_row.name == row.name and new_row.kind == row.kind and new_row.school == row.school and (counts[item_name] == 0 or new_row.real_name != row.real_name):
                     counts[item_name] += 1
             if len(desc_strings[desc_index]) >= 2500:
                 desc_index += 1
@@ -384,7 +243,6 @@ class Items(commands.GroupCog, name="item"):
         kind: Optional[Literal["Hat", "Outfit", "Boots", "Weapon", "Accessory", "Totem", "Charm", "Ring", "Mount"]] = "Any",
         level: Optional[int] = -1,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested item list for '{}'", interaction.user.name, name)
         else:
@@ -402,11 +260,11 @@ class Items(commands.GroupCog, name="item"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Item list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for '{}'", name)
             embed = discord.Embed(description=f"No items containing name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
 
     @app_commands.command(name="abilitysearch", description="Searches for items that have a given ability")
     @app_commands.describe(name="The name of the ability to search for", school="The class the items require", kind="The type of items to search for", level="The level the items require (also includes items that require a higher level)")
@@ -418,7 +276,6 @@ class Items(commands.GroupCog, name="item"):
         kind: Optional[Literal["Hat", "Outfit", "Boots", "Weapon", "Accessory", "Totem", "Charm", "Ring", "Mount"]] = "Any",
         level: Optional[int] = -1,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested item list for ability '{}'", interaction.user.name, name)
         else:
@@ -429,20 +286,15 @@ class Items(commands.GroupCog, name="item"):
         else:
             rows = await self.fetch_item_ability_list(name)
         if not rows:
-            talents = Talents(self.bot)
-            powers = Powers(self.bot)
-            filtered_rows = await talents.fetch_talent_filter_list(items=self.bot.talent_list, ranks=-1)
-            filtered_rows.extend(await powers.fetch_power_filter_list(items=self.bot.power_list))
-            closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-            closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-            closest_rows = list(zip(*closest_rows))[0]
-            if school != "All" or kind != "Any" or level != -1:
-                rows = await self.fetch_item_ability_list_with_filter(ability=closest_rows[0][-1], school=school, kind=kind, level=level)
-            else:
-                rows = await self.fetch_item_ability_list(ability=closest_rows[0][-1])
-            if rows:
-                logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-            name = closest_rows[0][-1]
+            suggestion = self.bot.search.closest(("talents", "powers"), name)
+            if suggestion is not None:
+                if school != "All" or kind != "Any" or level != -1:
+                    rows = await self.fetch_item_ability_list_with_filter(ability=suggestion, school=school, kind=kind, level=level)
+                else:
+                    rows = await self.fetch_item_ability_list(ability=suggestion)
+                if rows:
+                    logger.info("Failed to find '{}' instead searching for {}", name, suggestion)
+                name = suggestion
         
         if rows:
             view = ItemView(await self.build_list_embed(rows, name, "Ability"))
@@ -451,11 +303,52 @@ class Items(commands.GroupCog, name="item"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Item list for ability {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching for items with ability: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for ability '{}'", name)
             embed = discord.Embed(description=f"No items with ability {name} found.").set_author(name=f"Searching for items with ability: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    @app_commands.command(name="top", description="Lists the items that give the most of a stat")
+    @app_commands.describe(stat="The stat to rank items by", school="The class that will use the items (also includes items any class can use)", kind="The type of items to rank", level="The level of whoever will use the items (excludes items that require a higher level)", count="How many items to show")
+    async def top(
+        self,
+        interaction: discord.Interaction,
+        stat: str,
+        school: Optional[Literal["Any", "Buccaneer", "Privateer", "Witchdoctor", "Musketeer", "Swashbuckler"]] = "All",
+        kind: Optional[Literal["Hat", "Outfit", "Boots", "Weapon", "Accessory", "Totem", "Charm", "Ring", "Mount"]] = "Any",
+        level: Optional[int] = -1,
+        count: Optional[app_commands.Range[int, 1, 50]] = 10,
+    ):
+        if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
+            logger.info("{} requested top items for stat '{}'", interaction.user.name, stat)
+        else:
+            logger.info("{} requested top items for stat '{}' in channel #{} of {}", interaction.user.name, stat, interaction.channel.name, interaction.guild.name)
+
+        matrix = self.bot.catalog.item_stats
+        stat_name = next((name for name in matrix.stats if normalize(name) == normalize(stat)), None)
+        if stat_name is None:
+            stat_name = closest_name(stat, matrix.stats)
+            if stat_name is not None:
+                logger.info("Failed to find stat '{}' instead searching for {}", stat, stat_name)
+
+        rows = []
+        if stat_name is not None:
+            rows = [(self.bot.catalog.items[id], value) for id, value in matrix.top(stat_name, school, kind, level, count)]
+
+        if rows:
+            description = ""
+            for item, value in rows:
+                description += f"{database.get_school_emoji(item.school)}{database.get_item_emoji(item.kind)} {item.name} ({item.real_name}): {format_stat(stat_name, value)} {database.get_stat_emoji(stat_name)}\n"
+            embed = discord.Embed(
+                color=discord.Color.greyple(),
+                description=description,
+            ).set_author(name=f"Top items by {stat_name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
+            logger.info("Failed to find top items for stat '{}'", stat)
+            embed = discord.Embed(description=f"No items with stat {stat} found.").set_author(name=f"Top items by {stat}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
 
 async def setup(bot: TheBot):
     await bot.add_cog(Items(bot))
\ No newline at end of file
@@ -1,4 +1,7 @@
-import aiosqlite
+import io
+import os
+from typing import Literal, Optional
+
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
@@ -6,11 +9,18 @@ from loguru import logger
 
 from .. import TheBot
 
+# The slash versions of these commands only ever show up in the home guild.
+HOME_GUILD_ID = int(os.environ["HOME_GUILD_ID"])
+
+# Tables whose rows carry an image column (after id, name and real_name).
+IMAGE_TABLES = ["items", "units", "pets", "talents", "powers"]
+
 class Owner(commands.Cog):
     def __init__(self, bot: TheBot):
         self.bot = bot
 
-    @commands.command(name="sync")
+    @commands.hybrid_command(name="sync", description="Syncs the command tree")
+    @app_commands.guilds(HOME_GUILD_ID)
     @commands.is_owner()
     async def sync(
         self,
@@ -18,11 +28,13 @@ class Owner(commands.Cog):
     ):
         if ctx.guild.id != int(self.bot.home_guild):
             raise commands.errors.NotOwner("You are not the owner.")
-        await self.bot.tree.sync()
+        await ctx.defer()
+        await self.bot.sync_commands(force=True)
         logger.info("Command tree synced.")
         await ctx.send("Command tree synced.")
     
-    @commands.command(name="reload")
+    @commands.hybrid_command(name="reload", description="Reloads one or more extensions")
+    @app_commands.guilds(HOME_GUILD_ID)
     @commands.is_owner()
     async def reload(
         self,
@@ -31,18 +43,23 @@ class Owner(commands.Cog):
     ):
         if ctx.guild.id != int(self.bot.home_guild):
             raise commands.errors.NotOwner("You are not the owner.")
+        await ctx.defer()
         extensions = extension.split(",")
         try:
             for this_extension in extensions:
                 await self.bot.reload_extension(f"bot.extensions.{this_extension}")
-            await self.bot.tree.sync()
+            # Render workers imported the old cog code, so they have to start over.
+            if self.bot.render is not None:
+                self.bot.render.restart()
+            await self.bot.sync_commands()
             logger.info(f"Extension(s) {extension} reloaded.")
             await ctx.send(f"Extension(s) {extension} reloaded.")
         except Exception as e:
             logger.info(f"Failed to reload extension(s) {extension}: {e}")
             await ctx.send(f"Failed to reload extension(s) {extension}: {e}")
 
-    @commands.command(name="load")
+    @commands.hybrid_command(name="load", description="Loads an extension")
+    @app_commands.guilds(HOME_GUILD_ID)
     @commands.is_owner()
     async def load(
         self,
@@ -51,16 +68,20 @@ class Owner(commands.Cog):
     ):
         if ctx.guild.id != int(self.bot.home_guild):
             raise commands.errors.NotOwner("You are not the owner.")
+        await ctx.defer()
         try:
             await self.bot.load_extension(f"bot.extensions.{extension}")
-            await self.bot.tree.sync()
+            if self.bot.render is not None:
+                self.bot.render.restart()
+            await self.bot.sync_commands()
             logger.info(f"Extension {extension} loaded.")
             await ctx.send(f"Extension {extension} loaded.")
         except Exception as e:
             logger.info(f"Failed to load extension {extension}: {e}")
             await ctx.send(f"Failed to load extension {extension}: {e}")
 
-    @commands.command(name="db")
+    @commands.hybrid_command(name="db", description="Reloads the database")
+    @app_commands.guilds(HOME_GUILD_ID)
     @commands.is_owner()
     async def reload_db(
         self,
@@ -68,10 +89,89 @@ class Owner(commands.Cog):
     ):
         if ctx.guild.id != int(self.bot.home_guild):
             raise commands.errors.NotOwner("You are not the owner.")
-        async with aiosqlite.connect(self.bot.db_path) as db:
-            self.bot.db = await aiosqlite.connect(":memory:")
-            await db.backup(self.bot.db)
+        await ctx.defer()
+        await self.bot.load_db()
         await ctx.send("Database reloaded.")
 
+    @commands.hybrid_command(name="images", description="Lists rows whose image is missing")
+    @app_commands.guilds(HOME_GUILD_ID)
+    @commands.is_owner()
+    async def missing_images(
+        self,
+        ctx: commands.Context[TheBot],
+    ):
+        if ctx.guild.id != int(self.bot.home_guild):
+            raise commands.errors.NotOwner("You are not the owner.")
+        await ctx.defer()
+        summary = []
+        report = []
+        for table in IMAGE_TABLES:
+            missing = []
+            for record in getattr(self.bot.catalog, table).values():
+                if record.image and not self.bot.images.has_image(record.image):
+                    missing.append(f"{table}: {record.real_name} ({record.id}) -> {record.image}")
+            summary.append(f"{table}: {len(missing)} missing")
+            report.extend(missing)
+        report_file = discord.File(io.BytesIO("\n".join(report).encode("utf-8")), filename="missing_images.txt")
+        await ctx.send("\n".join(summary), file=report_file)
+
+    @commands.hybrid_command(name="alias", description="Adds, changes or removes a shorthand name")
+    @app_commands.guilds(HOME_GUILD_ID)
+    @commands.is_owner()
+    async def alias(
+        self,
+        ctx: commands.Context[TheBot],
+        kind: Literal["items", "pets", "powers", "talents", "units"],
+        alias: str,
+        name: Optional[str] = None,
+    ):
+        if ctx.guild.id != int(self.bot.home_guild):
+            raise commands.errors.NotOwner("You are not the owner.")
+        if name:
+            records = self.bot.search.resolve(kind, name)
+            if not records:
+                await ctx.send(f"No {kind} named {name}.")
+                return
+            name = records[0].name
+        self.bot.aliases.set(kind, alias, name)
+        self.bot.search.set_aliases(self.bot.aliases)
+        if self.bot.render is not None:
+            self.bot.render.restart()
+        logger.info("Alias {} for {} set to {}", alias, kind, name)
+        if name:
+            await ctx.send(f"{alias} now finds {name}.")
+        else:
+            await ctx.send(f"Removed alias {alias}.")
+
+    @commands.hybrid_command(name="stats", description="Shows runtime counters")
+    @app_commands.guilds(HOME_GUILD_ID)
+    @commands.is_owner()
+    async def stats(
+        self,
+        ctx: commands.Context[TheBot],
+    ):
+        if ctx.guild.id != int(self.bot.home_guild):
+            raise commands.errors.NotOwner("You are not the owner.")
+        single_flight = self.bot.single_flight
+        image_urls = self.bot.image_urls
+        admission = self.bot.tree.admission
+        lines = [
+            f"Lookups: {single_flight.computed} computed, {single_flight.shared} shared with an identical lookup already running",
+            f"Image URLs: {image_urls.hits} hits, {image_urls.misses} misses, {image_urls.uploads} uploads",
+            f"Admission: {admission.admitted} admitted, {admission.limited} rate limited, {admission.rejected} rejected while busy, {admission.waiting} waiting, {admission.scans_waiting} scans waiting",
+            f"Fast path: {self.bot.tree.direct} answered directly, {self.bot.tree.deferred} deferred",
+            f"Scan budget: {self.bot.scan_db.interrupted} interrupted, {self.bot.scan_db.truncated} over the row limit",
+            "Search: " + ", ".join(f"{count} {stage}" for stage, count in self.bot.search.hits.items()),
+        ]
+        corrections = self.bot.corrections
+        lookups = corrections.hits + corrections.misses
+        lines.append(
+            f"Typo corrections: {corrections.hits} hits, {corrections.misses} misses ({corrections.hits * 100 / max(lookups, 1):.0f}% hit rate), "
+            f"{len(corrections.corrections)}/{corrections.limit} kept, {corrections.evictions} evicted, ~{corrections.saved_time():.2f}s of fuzzy matching avoided"
+        )
+        if self.bot.render is not None:
+            lines.append(f"Render workers: {self.bot.render.workers} processes, {self.bot.render.rendered} rendered, {self.bot.render.failed} failed")
+        await ctx.send("\n".join(lines))
+
 async def setup(bot: TheBot):
     await bot.add_cog(Owner(bot))
\ No newline at end of file
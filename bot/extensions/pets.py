@@ -1,29 +1,13 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
-import re
-import os
-from random import choice
 
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
 from loguru import logger
 
-from .. import TheBot, database, emojis
+from .. import TheBot, database, emojis, respond
 from ..menus import ItemView
-
-FIND_PET_QUERY = """
-SELECT * FROM pets
-LEFT JOIN locale_en ON locale_en.id == pets.name
-WHERE locale_en.data == ? COLLATE NOCASE
-"""
-
-FIND_OBJECT_NAME_QUERY = """
-SELECT * FROM pets
-WHERE pets.real_name == ? COLLATE NOCASE
-"""
+from ..records import PetRecord
 
 TALENT_NAME_ID_QUERY_1 = """
 SELECT * FROM indiv_pet_talents WHERE indiv_pet_talents.pet == ?
@@ -41,18 +25,6 @@ POWER_NAME_ID_QUERY_2 = """
 SELECT * FROM pet_powers WHERE pet_powers.id == ?
 """
 
-FIND_PET_CONTAIN_STRING_QUERY = """
-SELECT * FROM pets
-LEFT JOIN locale_en ON locale_en.id == pets.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-"""
-
-FIND_PET_PLACEHOLDER_QUERY = """
-SELECT * FROM pets
-INNER JOIN locale_en ON locale_en.id == pets.name
-WHERE locale_en.data COLLATE NOCASE IN ({placeholders})
-"""
-
 def remove_indices(lst, indices):
     return [value for index, value in enumerate(lst) if index not in indices]
 
@@ -60,18 +32,8 @@ class Pets(commands.GroupCog, name="pet"):
     def __init__(self, bot: TheBot):
         self.bot = bot
 
-    async def fetch_pet(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_PET_QUERY, (name,)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_object_name(self, name: str) -> List[tuple]:
-        name_bytes = name.encode('utf-8')
-        async with self.bot.db.execute(FIND_OBJECT_NAME_QUERY, (name_bytes,)) as cursor:
-            return await cursor.fetchall()
-
-    async def fetch_pet_list(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_PET_CONTAIN_STRING_QUERY, (name.lower(),)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_pet_list(self, name: str) -> List[PetRecord]:
+        return self.bot.search.contains("pets", name)
     
     async def fetch_pet_talents(self, id: str) -> List[tuple]:
         talents = []
@@ -99,45 +61,22 @@ class Pets(commands.GroupCog, name="pet"):
         
         return final_powers
     
-    async def fetch_pet_filter_list(self, items) -> List[tuple]:
-        if isinstance(items, str):
-            items = [items]
-
-        results = []
-        for chunk in database.sql_chunked(items, 900):  # Stay under SQLite's limit
-            placeholders = database._make_placeholders(len(chunk))
-            query = FIND_PET_PLACEHOLDER_QUERY.format(placeholders=placeholders)
-
-            args = (
-                *chunk,
-            )
-
-            async with self.bot.db.execute(query, args) as cursor:
-                rows = await cursor.fetchall()
-
-            results.extend(rows)
-
-        return results
-
-    async def build_pet_embed(self, row):
-        pet_id = row[0]
-        real_name = row[2].decode("utf-8")
+    async def build_pet_embed(self, pet: PetRecord):
+        pet_id = pet.id
+        real_name = pet.real_name
         
-        strength = row[4]
-        agility = row[5]
-        will = row[6]
-        stat_power = row[7]
-        guts = row[8]
-        guile = row[9]
-        grit = row[10]
-        health = row[11]
-
-        pet_name = await database.translate_name(self.bot.db, row[1])
-        try:
-            pet_image = row[3].decode("utf-8")
-        except:
-            pet_image = ""
-        pet_flags = row[12]
+        strength = pet.strength
+        agility = pet.agility
+        will = pet.will
+        stat_power = pet.power
+        guts = pet.guts
+        guile = pet.guile
+        grit = pet.grit
+        health = pet.health
+
+        pet_name = pet.name
+        pet_image = pet.image or ""
+        pet_flags = pet.flags
 
         talents = await self.fetch_pet_talents(pet_id)
         powers = await self.fetch_pet_powers(pet_id)
@@ -198,16 +137,7 @@ class Pets(commands.GroupCog, name="pet"):
 
         discord_file = None
         if pet_image:
-            try:
-                image_name = pet_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, pet_image)
 
 
         flags = database.translate_flags(pet_flags)
@@ -225,53 +155,47 @@ class Pets(commands.GroupCog, name="pet"):
         name: str,
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested pet '{}'", interaction.user.name, name)
         else:
             logger.info("{} requested pet '{}' in channel #{} of {}", interaction.user.name, name, interaction.channel.name, interaction.guild.name)
 
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No pets with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-
-        else:
-            rows = await self.fetch_pet(name)
-
-            if not rows:
-                filtered_rows = await self.fetch_pet_filter_list(items=self.bot.pet_list)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                rows = await self.fetch_pet(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-
-        if rows:
-            embeds = [await self.build_pet_embed(row) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+        # Identical lookups running at the same time share one search and render.
+        key = ("pet find", name, use_object_name, self.bot.db_version)
+        embeds = await self.bot.single_flight.do(key, lambda: self.bot.render_embeds(self.find_embeds, name, use_object_name))
+        
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             try:
                 await view.start(interaction)
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message")
                 embed = discord.Embed(description=f"Pet list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        elif not use_object_name:
+                await respond.send(interaction, embed=embed)
+        elif use_object_name:
+            embed = discord.Embed(description=f"No pets with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No pets with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    async def find_embeds(self, name: str, use_object_name: bool):
+        rows, stage = self.bot.search.find("pets", name, use_object_name=use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_pet_embed(row) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
 
-    async def build_list_embed(self, rows: List[tuple], name: str):
+    async def build_list_embed(self, rows: List[PetRecord], name: str):
         desc_strings = []
         desc_index = 0
         desc_strings.append("")
         for row in rows:
-            real_name = row[2].decode("utf-8")
-            pet_name = await database.translate_name(self.bot.db, row[1])
+            real_name = row.real_name
+            pet_name = row.name
             if len(desc_strings[desc_index]) >= 1000:
                 desc_index += 1
                 desc_strings.append("")
@@ -294,7 +218,6 @@ class Pets(commands.GroupCog, name="pet"):
         interaction: discord.Interaction,
         name: str,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested pet list for '{}'", interaction.user.name, name)
         else:
@@ -309,11 +232,11 @@ class Pets(commands.GroupCog, name="pet"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Pet list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for '{}'", name)
             embed = discord.Embed(description=f"No pets containing name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
 
 async def setup(bot: TheBot):
     await bot.add_cog(Pets(bot))
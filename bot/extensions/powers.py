@@ -1,35 +1,14 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
 import re
-import os
-from random import choice
 
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
 from loguru import logger
 
-from .. import TheBot, database, emojis
+from .. import TheBot, database, emojis, respond
 from ..menus import ItemView
-
-FIND_POWER_QUERY = """
-SELECT * FROM powers
-LEFT JOIN locale_en ON locale_en.id == powers.name
-WHERE locale_en.data == ? COLLATE NOCASE
-"""
-
-FIND_OBJECT_NAME_QUERY = """
-SELECT * FROM powers
-WHERE powers.real_name == ? COLLATE NOCASE
-"""
-
-FIND_POWER_CONTAIN_STRING_QUERY = """
-SELECT * FROM powers
-LEFT JOIN locale_en ON locale_en.id == powers.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-"""
+from ..records import PowerRecord
 
 FIND_POWER_ADJUSTMENTS_QUERY = """
 SELECT * FROM power_adjustments WHERE power_adjustments.power == ?
@@ -39,28 +18,12 @@ FIND_POWER_INFO_QUERY = """
 SELECT * FROM power_info WHERE power_info.power == ?
 """
 
-FIND_POWER_PLACEHOLDER_QUERY = """
-SELECT * FROM powers
-INNER JOIN locale_en ON locale_en.id == powers.name
-WHERE locale_en.data COLLATE NOCASE IN ({placeholders})
-"""
-
 class Powers(commands.GroupCog, name="power"):
     def __init__(self, bot: TheBot):
         self.bot = bot
     
-    async def fetch_power(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_POWER_QUERY, (name,)) as cursor:
-            return await cursor.fetchall()
-
-    async def fetch_object_name(self, name: str) -> List[tuple]:
-        name_bytes = name.encode('utf-8')
-        async with self.bot.db.execute(FIND_OBJECT_NAME_QUERY, (name_bytes,)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_power_list(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_POWER_CONTAIN_STRING_QUERY, (name.lower(),)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_power_list(self, name: str) -> List[PowerRecord]:
+        return self.bot.search.contains("powers", name)
         
     async def fetch_power_adjustments(self, id: str) -> List[tuple]:
         async with self.bot.db.execute(FIND_POWER_ADJUSTMENTS_QUERY, (id,)) as cursor:
@@ -70,36 +33,13 @@ class Powers(commands.GroupCog, name="power"):
         async with self.bot.db.execute(FIND_POWER_INFO_QUERY, (id,)) as cursor:
             return await cursor.fetchall()
         
-    async def fetch_power_filter_list(self, items) -> List[tuple]:
-        if isinstance(items, str):
-            items = [items]
-
-        results = []
-        for chunk in database.sql_chunked(items, 900):  # Stay under SQLite's limit
-            placeholders = database._make_placeholders(len(chunk))
-            query = FIND_POWER_PLACEHOLDER_QUERY.format(placeholders=placeholders)
-
-            args = (
-                *chunk,
-            )
+    async def build_power_embed(self, power: PowerRecord):
+        power_id = power.id
+        real_name = power.real_name
 
-            async with self.bot.db.execute(query, args) as cursor:
-                rows = await cursor.fetchall()
-
-            results.extend(rows)
-
-        return results
-        
-    async def build_power_embed(self, row):
-        power_id = row[0]
-        real_name = row[2].decode("utf-8")
-
-        power_name = await database.translate_name(self.bot.db, row[1])
-        try:
-            power_image = row[3].decode("utf-8")
-        except:
-            power_image = row[3]
-        power_desc = await database.translate_name(self.bot.db, row[4])
+        power_name = power.name
+        power_image = power.image
+        power_desc = await database.translate_name(self.bot.db, power.description)
 
         power_adjustments = await self.fetch_power_adjustments(power_id)
         power_info = await self.fetch_power_info(power_id)
@@ -556,9 +496,9 @@ class Powers(commands.GroupCog, name="power"):
         if "<font color=" in power_desc:
             power_desc = re.sub(r'<font color="(.*?)">', '', power_desc)
 
-        pvp_tag = row[5]
-        target_type = row[6]
-        target_area = row[7]
+        pvp_tag = power.pvp_tag
+        target_type = power.target_type
+        target_area = power.target_area
 
         embed = (
             discord.Embed(
@@ -575,16 +515,7 @@ class Powers(commands.GroupCog, name="power"):
 
         discord_file = None
         if power_image:
-            try:
-                image_name = power_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, power_image)
         
         return embed, discord_file
     
@@ -596,48 +527,42 @@ class Powers(commands.GroupCog, name="power"):
         name: str,
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested power '{}'", interaction.user.name, name)
         else:
             logger.info("{} requested power '{}' in channel #{} of {}", interaction.user.name, name, interaction.channel.name, interaction.guild.name)
         
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No powers with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        
-        else:
-            rows = await self.fetch_power(name)
+        # Identical lookups running at the same time share one search and render.
+        key = ("power find", name, use_object_name, self.bot.db_version)
+        embeds = await self.bot.single_flight.do(key, lambda: self.bot.render_embeds(self.find_embeds, name, use_object_name))
 
-            if not rows:
-                filtered_rows = await self.fetch_power_filter_list(items=self.bot.power_list)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                rows = await self.fetch_power(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-        
-        if rows:
-            embeds = [await self.build_power_embed(row) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             await view.start(interaction)
-        elif not use_object_name:
+        elif use_object_name:
+            embed = discord.Embed(description=f"No powers with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No powers with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    async def find_embeds(self, name: str, use_object_name: bool):
+        rows, stage = self.bot.search.find("powers", name, use_object_name=use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_power_embed(row) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
     
-    async def build_list_embed(self, rows: List[tuple], name: str):
+    async def build_list_embed(self, rows: List[PowerRecord], name: str):
         desc_strings = []
         desc_index = 0
         desc_strings.append("")
         for row in rows:
-            real_name = row[2].decode("utf-8")
-            power_name = await database.translate_name(self.bot.db, row[1])
+            real_name = row.real_name
+            power_name = row.name
             if len(desc_strings[desc_index]) >= 1000:
                 desc_index += 1
                 desc_strings.append("")
@@ -660,7 +585,6 @@ class Powers(commands.GroupCog, name="power"):
         interaction: discord.Interaction,
         name: str,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested power list for '{}'", interaction.user.name, name)
         else:
@@ -675,11 +599,11 @@ class Powers(commands.GroupCog, name="power"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Power list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for '{}'", name)
             embed = discord.Embed(description=f"No powers containing name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
 
 async def setup(bot: TheBot):
     await bot.add_cog(Powers(bot))
\ No newline at end of file
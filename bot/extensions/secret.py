@@ -1,10 +1,4 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
-import re
-import os
-from random import choice
 from datetime import datetime
 import pytz
 
@@ -58,7 +52,6 @@ class Secret(commands.GroupCog, name="secret"):
         self,
         interaction: discord.Interaction,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested current secret trainer", interaction.user.name)
         else:
@@ -87,17 +80,9 @@ class Secret(commands.GroupCog, name="secret"):
         ).set_author(name=f"Current secret trainer", icon_url=emojis.UNIVERSAL.url)
         files = []
         embeds = []
-        try:
-            image_name = portrait
-            png_file = f"{image_name}.png"
-            png_name = png_file.replace(" ", "")
-            png_name = os.path.basename(png_name)
-            file_path = Path("PNG_Images") / png_name
-            discord_file = discord.File(file_path, filename=png_name)
-            embed.set_thumbnail(url=f"attachment://{png_name}")
+        discord_file = self.bot.images.attach(embed, portrait)
+        if discord_file:
             files.append(discord_file)
-        except:
-            pass
         embeds.append(embed)
         view = ItemView(embeds, files=files)
         await view.start(interaction)
@@ -109,7 +94,6 @@ class Secret(commands.GroupCog, name="secret"):
         interaction: discord.Interaction,
         trainer: Literal["Kurotadori (Staffy)", "Firenzian (Shooty)", "Lost Hoplite (Melee)"],
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested the schedule for {}", interaction.user.name, trainer)
         else:
@@ -140,17 +124,9 @@ class Secret(commands.GroupCog, name="secret"):
 
         embeds = []
         files = []
-        try:
-            image_name = portrait
-            png_file = f"{image_name}.png"
-            png_name = png_file.replace(" ", "")
-            png_name = os.path.basename(png_name)
-            file_path = Path("PNG_Images") / png_name
-            discord_file = discord.File(file_path, filename=png_name)
-            embed.set_thumbnail(url=f"attachment://{png_name}")
+        discord_file = self.bot.images.attach(embed, portrait)
+        if discord_file:
             files.append(discord_file)
-        except:
-            pass
         embeds.append(embed)
         view = ItemView(embeds, files=files)
         await view.start(interaction)
@@ -1,92 +1,32 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
-import re
-import os
-from random import choice
 
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
 from loguru import logger
 
-from .. import TheBot, database, emojis
+from .. import TheBot, database, emojis, respond
 from ..menus import ItemView
-
-FIND_TALENT_QUERY = """
-SELECT * FROM talents
-LEFT JOIN locale_en ON locale_en.id == talents.name
-WHERE locale_en.data == ? COLLATE NOCASE
-"""
-
-FIND_OBJECT_NAME_QUERY = """
-SELECT * FROM talents
-WHERE talents.real_name == ? COLLATE NOCASE
-"""
+from ..records import TalentRecord
+from ..search import talent_facets
 
 FIND_TALENT_RANKS_QUERY = """
 SELECT * FROM talent_ranks WHERE talent_ranks.talent == ?
 """
 
-FIND_TALENTS_WITH_FILTER_QUERY = """
-SELECT * FROM talents
-INNER JOIN locale_en ON locale_en.id == talents.name
-WHERE locale_en.data == ? COLLATE NOCASE
-AND (? = -1 OR talents.ranks = ?)
-COLLATE NOCASE
-"""
-
-FIND_TALENT_CONTAIN_STRING_QUERY = """
-SELECT * FROM talents
-LEFT JOIN locale_en ON locale_en.id == talents.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-"""
-
-FIND_TALENT_CONTAIN_STRING_WITH_FILTER_QUERY = """
-SELECT * FROM talents
-LEFT JOIN locale_en ON locale_en.id == talents.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-AND (? = -1 OR talents.ranks = ?)
-COLLATE NOCASE
-"""
-
 FIND_TALENT_STATS_QUERY = """
 SELECT * FROM talent_stats WHERE talent_stats.talent == ?
 """
 
-FIND_TALENTS_WITH_FILTER_PLACEHOLDER_QUERY = """
-SELECT * FROM talents
-INNER JOIN locale_en ON locale_en.id == talents.name
-WHERE locale_en.data COLLATE NOCASE IN ({placeholders})
-AND (? = -1 OR talents.ranks = ?)
-COLLATE NOCASE
-"""
-
 class Talents(commands.GroupCog, name="talent"):
     def __init__(self, bot: TheBot):
         self.bot = bot
 
-    async def fetch_talent(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_TALENT_QUERY, (name,)) as cursor:
-            return await cursor.fetchall()
-
-    async def fetch_object_name(self, name: str) -> List[tuple]:
-        name_bytes = name.encode('utf-8')
-        async with self.bot.db.execute(FIND_OBJECT_NAME_QUERY, (name_bytes,)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_talent_with_filter(self, name: str, ranks: int) -> List[tuple]:
-        async with self.bot.db.execute(FIND_TALENTS_WITH_FILTER_QUERY, (name,ranks,ranks)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_talent_list(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_TALENT_CONTAIN_STRING_QUERY, (name.lower(),)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_talent_list(self, name: str) -> List[TalentRecord]:
+        return self.bot.search.contains("talents", name)
     
-    async def fetch_talent_list_with_filter(self, name: str, ranks: int) -> List[tuple]:
-        async with self.bot.db.execute(FIND_TALENT_CONTAIN_STRING_WITH_FILTER_QUERY, (name.lower(),ranks,ranks)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_talent_list_with_filter(self, name: str, ranks: int) -> List[TalentRecord]:
+        return self.bot.search.contains("talents", name, talent_facets(ranks))
         
     async def fetch_talent_ranks(self, id: str) -> List[tuple]:
         async with self.bot.db.execute(FIND_TALENT_RANKS_QUERY, (id,)) as cursor:
@@ -96,38 +36,14 @@ class Talents(commands.GroupCog, name="talent"):
         async with self.bot.db.execute(FIND_TALENT_STATS_QUERY, (id,)) as cursor:
             return await cursor.fetchall()
         
-    async def fetch_talent_filter_list(self, items, ranks: int) -> List[tuple]:
-        if isinstance(items, str):
-            items = [items]
-
-        results = []
-        for chunk in database.sql_chunked(items, 900):  # Stay under SQLite's limit
-            placeholders = database._make_placeholders(len(chunk))
-            query = FIND_TALENTS_WITH_FILTER_PLACEHOLDER_QUERY.format(placeholders=placeholders)
+    async def build_talent_embed(self, talent: TalentRecord):
+        talent_id = talent.id
+        real_name = talent.real_name
 
-            args = (
-                *chunk,
-                ranks, ranks
-            )
+        talent_name = talent.name
+        talent_image = talent.image or ""
 
-            async with self.bot.db.execute(query, args) as cursor:
-                rows = await cursor.fetchall()
-
-            results.extend(rows)
-
-        return results
-    
-    async def build_talent_embed(self, row):
-        talent_id = row[0]
-        real_name = row[2].decode("utf-8")
-
-        talent_name = await database.translate_name(self.bot.db, row[1])
-        try:
-            talent_image = row[3].decode("utf-8")
-        except:
-            talent_image = ""
-
-        talent_rank_num = row[4]
+        talent_rank_num = talent.ranks
 
         talent_ranks = await self.fetch_talent_ranks(talent_id)
 
@@ -254,16 +170,7 @@ class Talents(commands.GroupCog, name="talent"):
 
         discord_file = None
         if talent_image:
-            try:
-                image_name = talent_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, talent_image)
 
         for rank in range(len(talent_rank_strings)):
             embed.add_field(name=f"Rank {talent_rank_nums[rank]}", value=talent_rank_strings[rank], inline=True)
@@ -279,53 +186,42 @@ class Talents(commands.GroupCog, name="talent"):
         ranks: Optional[int] = -1,
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested talent '{}'", interaction.user.name, name)
         else:
             logger.info("{} requested talent '{}' in channel #{} of {}", interaction.user.name, name, interaction.channel.name, interaction.guild.name)
         
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No talents with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        
-        else:
-            if ranks != -1:
-                rows = await self.fetch_talent_with_filter(name, ranks)
-            else:
-                rows = await self.fetch_talent(name)
-            if not rows:
-                filtered_rows = await self.fetch_talent_filter_list(items=self.bot.talent_list, ranks=ranks)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                if ranks != -1:
-                    rows = await self.fetch_talent_with_filter(name=closest_rows[0][-1], ranks=ranks)
-                else:
-                    rows = await self.fetch_talent(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-        
-        if rows:
-            embeds = [await self.build_talent_embed(row) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+        # Identical lookups running at the same time share one search and render.
+        key = ("talent find", name, ranks, use_object_name, self.bot.db_version)
+        embeds = await self.bot.single_flight.do(key, lambda: self.bot.render_embeds(self.find_embeds, name, ranks, use_object_name))
+
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             await view.start(interaction)
-        elif not use_object_name:
+        elif use_object_name:
+            embed = discord.Embed(description=f"No talents with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No talents with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    async def find_embeds(self, name: str, ranks: int, use_object_name: bool):
+        rows, stage = self.bot.search.find("talents", name, talent_facets(ranks), use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_talent_embed(row) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
 
-    async def build_list_embed(self, rows: List[tuple], name: str):
+    async def build_list_embed(self, rows: List[TalentRecord], name: str):
         desc_strings = []
         desc_index = 0
         desc_strings.append("")
         for row in rows:
-            real_name = row[2].decode("utf-8")
-            talent_name = await database.translate_name(self.bot.db, row[1])
+            real_name = row.real_name
+            talent_name = row.name
             if len(desc_strings[desc_index]) >= 1000:
                 desc_index += 1
                 desc_strings.append("")
@@ -349,7 +245,6 @@ class Talents(commands.GroupCog, name="talent"):
         name: str,
         ranks: Optional[int] = -1,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested talent list for '{}'", interaction.user.name, name)
         else:
@@ -367,11 +262,11 @@ class Talents(commands.GroupCog, name="talent"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Talent list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for '{}'", name)
             embed = discord.Embed(description=f"No talents containing name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
 
 async def setup(bot: TheBot):
     await bot.add_cog(Talents(bot))
\ No newline at end of file
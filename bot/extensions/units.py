@@ -1,30 +1,15 @@
 from typing import List, Optional, Literal
-from fuzzywuzzy import process, fuzz
-from operator import attrgetter
-from pathlib import Path
-import re
-import os
 import math
-from random import choice
 
 import discord
 from discord import app_commands, PartialMessageable, DMChannel
 from discord.ext import commands
 from loguru import logger
 
-from .. import TheBot, database, emojis
+from .. import TheBot, database, emojis, respond
 from ..menus import ItemView
-
-FIND_UNIT_QUERY = """
-SELECT * FROM units
-LEFT JOIN locale_en ON locale_en.id == units.name
-WHERE locale_en.data == ? COLLATE NOCASE
-"""
-
-FIND_OBJECT_NAME_QUERY = """
-SELECT * FROM units
-WHERE units.real_name == ? COLLATE NOCASE
-"""
+from ..records import UnitRecord
+from ..search import unit_facets
 
 FIND_UNIT_STATS_QUERY = """
 SELECT * FROM unit_stats WHERE unit_stats.unit == ?
@@ -34,39 +19,6 @@ FIND_UNIT_TALENTS_QUERY = """
 SELECT * FROM unit_talents WHERE unit_talents.unit == ?
 """
 
-FIND_UNITS_WITH_FILTER_QUERY = """
-SELECT * FROM units
-INNER JOIN locale_en ON locale_en.id == units.name
-WHERE locale_en.data == ? COLLATE NOCASE
-AND (? = 'Any' OR units.school = ?)
-AND (? = 'Any' OR units.kind = ?)
-COLLATE NOCASE
-"""
-
-FIND_UNIT_CONTAIN_STRING_QUERY = """
-SELECT * FROM units
-LEFT JOIN locale_en ON locale_en.id == units.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-"""
-
-FIND_UNITS_CONTAIN_STRING_WITH_FILTER_QUERY = """
-SELECT * FROM units
-INNER JOIN locale_en ON locale_en.id == units.name
-WHERE INSTR(lower(locale_en.data), ?) > 0
-AND (? = 'Any' OR units.school = ?)
-AND (? = 'Any' OR units.kind = ?)
-COLLATE NOCASE
-"""
-
-FIND_UNIT_WITH_FILTER_PLACEHOLDER_QUERY = """
-SELECT * FROM units
-INNER JOIN locale_en ON locale_en.id == units.name
-WHERE locale_en.data COLLATE NOCASE IN ({placeholders})
-AND (? = 'Any' OR units.school = ?)
-AND (? = 'Any' OR units.kind = ?)
-COLLATE NOCASE
-"""
-
 FIND_CURVE_POWERS_QUERY = """
 SELECT * FROM curve_abilities
 WHERE curve_abilities.curve == ?
@@ -81,26 +33,11 @@ class Units(commands.GroupCog, name="unit"):
     def __init__(self, bot: TheBot):
         self.bot = bot
 
-    async def fetch_unit(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_UNIT_QUERY, (name,)) as cursor:
-            return await cursor.fetchall()
-
-    async def fetch_object_name(self, name: str) -> List[tuple]:
-        name_bytes = name.encode('utf-8')
-        async with self.bot.db.execute(FIND_OBJECT_NAME_QUERY, (name_bytes,)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_unit_with_filter(self, name: str, school: str, kind: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_UNITS_WITH_FILTER_QUERY, (name,school,school,kind,kind)) as cursor:
-            return await cursor.fetchall()
-        
-    async def fetch_unit_list(self, name: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_UNIT_CONTAIN_STRING_QUERY, (name.lower(),)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_unit_list(self, name: str) -> List[UnitRecord]:
+        return self.bot.search.contains("units", name)
     
-    async def fetch_unit_list_with_filter(self, name: str, school: str, kind: str) -> List[tuple]:
-        async with self.bot.db.execute(FIND_UNITS_CONTAIN_STRING_WITH_FILTER_QUERY, (name.lower(),school,school,kind,kind)) as cursor:
-            return await cursor.fetchall()
+    async def fetch_unit_list_with_filter(self, name: str, school: str, kind: str) -> List[UnitRecord]:
+        return self.bot.search.contains("units", name, unit_facets(school, kind))
         
     async def fetch_unit_stats(self, id: str) -> List[tuple]:
         async with self.bot.db.execute(FIND_UNIT_STATS_QUERY, (id,)) as cursor:
@@ -110,28 +47,6 @@ class Units(commands.GroupCog, name="unit"):
         async with self.bot.db.execute(FIND_UNIT_TALENTS_QUERY, (id,)) as cursor:
             return await cursor.fetchall()
     
-    async def fetch_unit_filter_list(self, items, school: str, kind: str) -> List[tuple]:
-        if isinstance(items, str):
-            items = [items]
-
-        results = []
-        for chunk in database.sql_chunked(items, 900):  # Stay under SQLite's limit
-            placeholders = database._make_placeholders(len(chunk))
-            query = FIND_UNIT_WITH_FILTER_PLACEHOLDER_QUERY.format(placeholders=placeholders)
-
-            args = (
-                *chunk,
-                school, school,
-                kind, kind,
-            )
-
-            async with self.bot.db.execute(query, args) as cursor:
-                rows = await cursor.fetchall()
-
-            results.extend(rows)
-
-        return results
-    
     async def fetch_curve_powers(self, curve_id: int) -> str:
         power_list = ""
         async with self.bot.db.execute(FIND_CURVE_POWERS_QUERY, (curve_id,)) as cursor:
@@ -153,21 +68,21 @@ class Units(commands.GroupCog, name="unit"):
                 return faction_name, gendered
 
         
-    async def build_unit_embed(self, row, show_talent_obj_names: bool, generate_random_name: bool):
-        unit_id = row[0]
-        real_name = row[2].decode("utf-8")
-
-        unit_name = await database.translate_name(self.bot.db, row[1])
-        unit_title = await database.translate_name(self.bot.db, row[4])
-        unit_image = row[3].decode("utf-8")
-
-        unit_gender = row[5]
-        unit_faction = row[6]
-        unit_school = row[7]
-        unit_dmg_type = row[8]
-        unit_primary_stat = database.translate_stat_flags(int(row[9]))
-        unit_primary_attack, unit_primary_attack_obj = await database.translate_power_name(self.bot.db, int(row[12]))
-        has_random_name = row[14]
+    async def build_unit_embed(self, unit: UnitRecord, show_talent_obj_names: bool, generate_random_name: bool):
+        unit_id = unit.id
+        real_name = unit.real_name
+
+        unit_name = unit.name
+        unit_title = unit.title
+        unit_image = unit.image
+
+        unit_gender = unit.gender
+        unit_faction = unit.faction
+        unit_school = unit.school
+        unit_dmg_type = unit.dmg_type
+        unit_primary_stat = database.translate_stat_flags(int(unit.primary_stat))
+        unit_primary_attack, unit_primary_attack_obj = await database.translate_power_name(self.bot.db, int(unit.primary_attack))
+        has_random_name = unit.random_name
 
         unit_stats = await self.fetch_unit_stats(unit_id)
         unit_talents = await self.fetch_unit_talents(unit_id)
@@ -218,12 +133,12 @@ class Units(commands.GroupCog, name="unit"):
                     starting_power_string += power_name + " " + " (" + object_name + ")\n"
                 elif talent[5] == "Trained":
                     trained_power_string += power_name + " " + " (" + object_name + ")\n"
-        if row[10] == 656670 and "Witch Hunter" not in trained_talent_string:
+        if unit.curve == 656670 and "Witch Hunter" not in trained_talent_string:
             trained_talent_string += "Witch Hunter 2\n"
-        if row[10] == 656667 and "Alert" not in starting_talent_string:
+        if unit.curve == 656667 and "Alert" not in starting_talent_string:
             starting_talent_string += "Alert 1\n"
-        if row[13]:
-            starting_power_string += await self.fetch_curve_powers(row[10])
+        if unit.curve_powers:
+            starting_power_string += await self.fetch_curve_powers(unit.curve)
         
         title_string = ""
         if (unit_name == unit_title and not has_random_name) or unit_title == "":
@@ -349,16 +264,7 @@ class Units(commands.GroupCog, name="unit"):
 
         discord_file = None
         if unit_image:
-            try:
-                image_name = unit_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, unit_image)
 
         return embed, discord_file
     
@@ -374,62 +280,57 @@ class Units(commands.GroupCog, name="unit"):
         generate_random_name: Optional[bool] = False,
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested unit '{}'", interaction.user.name, name)
         else:
             logger.info("{} requested unit '{}' in channel #{} of {}", interaction.user.name, name, interaction.channel.name, interaction.guild.name)
         
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No units with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        
+        # Identical lookups running at the same time share one search and render,
+        # unless each caller should get a name of their own. The name is matched
+        # exactly, since fuzzy scoring tells upper and lower case apart.
+        render = lambda: self.bot.render_embeds(self.find_embeds, name, school, kind, show_talent_obj_names, generate_random_name, use_object_name)
+        if generate_random_name:
+            embeds = await render()
         else:
-            if school != "Any" or kind != "Any":
-                rows = await self.fetch_unit_with_filter(name, school, kind)
-            else:
-                rows = await self.fetch_unit(name)
-            if not rows:
-                filtered_rows = await self.fetch_unit_filter_list(items=self.bot.unit_list, school=school, kind=kind)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                if school != "Any" or kind != "Any":
-                    rows = await self.fetch_unit_with_filter(name=closest_rows[0][-1], school=school, kind=kind)
-                else:
-                    rows = await self.fetch_unit(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
-        
-        if rows:
-            embeds = [await self.build_unit_embed(row, show_talent_obj_names, generate_random_name) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+            key = ("unit find", name, school, kind, show_talent_obj_names, use_object_name, self.bot.db_version)
+            embeds = await self.bot.single_flight.do(key, render)
+
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             await view.start(interaction)
-        elif not use_object_name:
+        elif use_object_name:
+            embed = discord.Embed(description=f"No units with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No units with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
 
-    async def build_list_embed(self, rows: List[tuple], name: str):
+    async def find_embeds(self, name: str, school: str, kind: str, show_talent_obj_names: bool, generate_random_name: bool, use_object_name: bool):
+        rows, stage = self.bot.search.find("units", name, unit_facets(school, kind), use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_unit_embed(row, show_talent_obj_names, generate_random_name) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
+
+    async def build_list_embed(self, rows: List[UnitRecord], name: str):
         desc_strings = []
         desc_index = 0
         desc_strings.append("")
         for row in rows:
-            real_name = row[2].decode("utf-8")
-            unit_name = await database.translate_name(self.bot.db, row[1])
+            real_name = row.real_name
+            unit_name = row.name
             unit_title = " - "
-            unit_title += await database.translate_name(self.bot.db, row[4])
-            unit_faction = row[6]
-            has_random_name = row[14]
+            unit_title += row.title
+            unit_faction = row.faction
+            has_random_name = row.random_name
             if f" - {unit_name}" == unit_title and has_random_name and await database.faction_has_names(self.bot.db, unit_faction):
                 unit_name = "*(Random Name)*"
             if f" - {unit_name}" == unit_title or unit_title == " - ":
                 unit_title = ""
-            unit_school = row[7]
+            unit_school = row.school
             if len(desc_strings[desc_index]) >= 1500:
                 desc_index += 1
                 desc_strings.append("")
@@ -454,7 +355,6 @@ class Units(commands.GroupCog, name="unit"):
         school: Optional[Literal["Buccaneer", "Privateer", "Witchdoctor", "Musketeer", "Swashbuckler"]] = "Any",
         kind: Optional[Literal["Ally", "Enemy"]] = "Any",
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested unit list for '{}'", interaction.user.name, name)
         else:
@@ -472,11 +372,11 @@ class Units(commands.GroupCog, name="unit"):
             except discord.errors.HTTPException:
                 logger.info("List for '{}' too long, sending back error message", name)
                 embed = discord.Embed(description=f"Unit list for {name} too long! Try again with a more specific keyword.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
+                await respond.send(interaction, embed=embed)
         else:
             logger.info("Failed to find list for '{}'", name)
             embed = discord.Embed(description=f"No units containing name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
     
     async def calc_unit_stats(self, curve, modifiers: List[tuple], level: int) -> List[tuple]:
         curve_stats, curve_types, curve_levels, curve_values = await database.fetch_curve(self.bot.db, curve)
@@ -610,18 +510,15 @@ class Units(commands.GroupCog, name="unit"):
 
         return final_stats
     
-    async def build_calc_embed(self, row, level: int):
-        unit_id = row[0]
-        real_name = row[2].decode("utf-8")
-        unit_faction = row[6]
-        has_random_name = row[14]
-
-        unit_name = await database.translate_name(self.bot.db, row[1])
-        unit_title = await database.translate_name(self.bot.db, row[4])
-        try:
-            unit_image = row[3].decode("utf-8")
-        except:
-            unit_image = ""
+    async def build_calc_embed(self, unit: UnitRecord, level: int):
+        unit_id = unit.id
+        real_name = unit.real_name
+        unit_faction = unit.faction
+        has_random_name = unit.random_name
+
+        unit_name = unit.name
+        unit_title = unit.title
+        unit_image = unit.image or ""
 
         title_string = ""
         if (unit_name == unit_title and not has_random_name) or unit_title == "":
@@ -634,8 +531,8 @@ class Units(commands.GroupCog, name="unit"):
         elif unit_name == unit_title:
             title_string = ""
 
-        unit_school = row[7]
-        unit_curve = row[10]
+        unit_school = unit.school
+        unit_curve = unit.curve
 
         unit_modifiers = await self.fetch_unit_stats(unit_id)
 
@@ -655,16 +552,7 @@ class Units(commands.GroupCog, name="unit"):
 
         discord_file = None
         if unit_image:
-            try:
-                image_name = unit_image.split(".")[0]
-                png_file = f"{image_name}.png"
-                png_name = png_file.replace(" ", "")
-                png_name = os.path.basename(png_name)
-                file_path = Path("PNG_Images") / png_name
-                discord_file = discord.File(file_path, filename=png_name)
-                embed.set_thumbnail(url=f"attachment://{png_name}")
-            except:
-                pass
+            discord_file = self.bot.images.attach(embed, unit_image)
 
         return embed, discord_file
     
@@ -679,45 +567,34 @@ class Units(commands.GroupCog, name="unit"):
         kind: Optional[Literal["Any", "Ally", "Enemy"]] = "Any",
         use_object_name: Optional[bool] = False,
     ):
-        await interaction.response.defer()
         if type(interaction.channel) is DMChannel or type(interaction.channel) is PartialMessageable:
             logger.info("{} requested unit stats for '{}' at level {}", interaction.user.name, name, level)
         else:
             logger.info("{} requested unit stats for '{}' at level {} in channel #{} of {}", interaction.user.name, name, level, interaction.channel.name, interaction.guild.name)
         
-        if use_object_name:
-            rows = await self.fetch_object_name(name)
-            if not rows:
-                embed = discord.Embed(description=f"No units with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-                await interaction.followup.send(embed=embed)
-        
-        else:
-            if school != "Any" or kind != "Any":
-                rows = await self.fetch_unit_with_filter(name, school, kind)
-            else:
-                rows = await self.fetch_unit(name)
-            if not rows:
-                filtered_rows = await self.fetch_unit_filter_list(items=self.bot.unit_list, school=school, kind=kind)
-                closest_rows = [(row, fuzz.token_set_ratio(name, row[-1]) + fuzz.ratio(name, row[-1])) for row in filtered_rows]
-                closest_rows = sorted(closest_rows, key=lambda x: x[1], reverse=True)
-                closest_rows = list(zip(*closest_rows))[0]
-                if school != "Any" or kind != "Any":
-                    rows = await self.fetch_unit_with_filter(name=closest_rows[0][-1], school=school, kind=kind)
-                else:
-                    rows = await self.fetch_unit(name=closest_rows[0][-1])
-                if rows:
-                    logger.info("Failed to find '{}' instead searching for {}", name, closest_rows[0][-1])
+        # Identical lookups running at the same time share one search and render.
+        key = ("unit calc", name, level, school, kind, use_object_name, self.bot.db_version)
+        embeds = await self.bot.single_flight.do(key, lambda: self.bot.render_embeds(self.calc_embeds, name, level, school, kind, use_object_name))
 
-        if rows:
-            embeds = [await self.build_calc_embed(row, level) for row in rows]
-            sorted_embeds = sorted(embeds, key=lambda embed: embed[0].author.name)
-            unzipped_embeds, unzipped_images = list(zip(*sorted_embeds))
-            view = ItemView(unzipped_embeds, files=unzipped_images)
+        if embeds:
+            unzipped_embeds, unzipped_images = list(zip(*embeds))
+            view = ItemView([embed.copy() for embed in unzipped_embeds], files=unzipped_images)
             await view.start(interaction)
-        elif not use_object_name:
+        elif use_object_name:
+            embed = discord.Embed(description=f"No units with object name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
+            await respond.send(interaction, embed=embed)
+        else:
             logger.info("Failed to find '{}'", name)
             embed = discord.Embed(description=f"No units with name {name} found.").set_author(name=f"Searching: {name}", icon_url=emojis.UNIVERSAL.url)
-            await interaction.followup.send(embed=embed)
+            await respond.send(interaction, embed=embed)
+
+    async def calc_embeds(self, name: str, level: int, school: str, kind: str, use_object_name: bool):
+        rows, stage = self.bot.search.find("units", name, unit_facets(school, kind), use_object_name)
+        if stage == "fuzzy" and rows:
+            logger.info("Failed to find '{}' instead searching for {}", name, rows[0].name)
+
+        embeds = [await self.build_calc_embed(row, level) for row in rows]
+        return sorted(embeds, key=lambda embed: embed[0].author.name)
 
 async def setup(bot: TheBot):
     await bot.add_cog(Units(bot))
\ No newline at end of file
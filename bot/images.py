@@ -0,0 +1,187 @@
+import asyncio
+import io
+import json
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Set
+from urllib.parse import urlparse, parse_qs
+
+import discord
+from loguru import logger
+
+# Discord signs attachment URLs with an expiry timestamp (the hex `ex` query
+# parameter). Drop cached URLs a little early so embeds never point at a dead link.
+URL_EXPIRY_MARGIN = 60 * 60
+
+# Written by MoveImagesToBot.py next to the loose PNGs. The manifest names the pack it describes.
+MANIFEST_NAME = "images.manifest.json"
+MANIFEST_VERSION = 2
+
+def url_expiry(url: str) -> Optional[int]:
+    try:
+        return int(parse_qs(urlparse(url).query)["ex"][0], 16)
+    except (KeyError, IndexError, ValueError):
+        return None
+
+class ImageUrlCache:
+    def __init__(self, path: Path):
+        self.path = path
+        self.urls: Dict[str, str] = {}
+        self.channel = None
+        # Maps an attachment name to the key its URL is cached under.
+        self.key: Callable[[str], str] = lambda file_name: file_name
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.urls = json.load(f)
+        except FileNotFoundError:
+            self.urls = {}
+        except (OSError, ValueError):
+            logger.exception("Failed loading image URL cache, starting empty")
+            self.urls = {}
+
+    def write(self, urls: Dict[str, str]):
+        # Written whole and swapped in, so a crash mid-write never leaves half a file.
+        temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(urls, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            logger.exception("Failed saving image URL cache")
+
+    async def flush(self):
+        # Copy the URLs on the event loop, where they change, and write them off the loop.
+        if self.dirty:
+            self.dirty = False
+            await asyncio.to_thread(self.write, dict(self.urls))
+
+    def get(self, file_name: str) -> Optional[str]:
+        key = self.key(file_name)
+        url = self.urls.get(key)
+        if url is not None:
+            expiry = url_expiry(url)
+            if expiry is None or time.time() < expiry - URL_EXPIRY_MARGIN:
+                self.hits += 1
+                return url
+            del self.urls[key]
+        self.misses += 1
+        return None
+
+    def remember(self, message: Optional[discord.Message]):
+        if not isinstance(message, discord.Message):
+            return
+        for attachment in message.attachments:
+            key = self.key(attachment.filename)
+            if self.urls.get(key) != attachment.url:
+                self.urls[key] = attachment.url
+                self.dirty = True
+
+    async def resolve(self, file_name: str, open_file: Callable[[str], discord.File]) -> Optional[str]:
+        url = self.get(file_name)
+        if url is not None or self.channel is None:
+            return url
+
+        # Seed the cache through the home guild's cache channel so the URL
+        # survives even if the user deletes the message it was first shown in.
+        try:
+            message = await self.channel.send(file=open_file(file_name))
+        except (OSError, discord.HTTPException):
+            logger.exception("Failed uploading {} to the image cache channel", file_name)
+            return None
+        self.uploads += 1
+        self.remember(message)
+        return self.urls.get(self.key(file_name))
+
+class ImageEntry(NamedTuple):
+    offset: int
+    size: int
+    width: int
+    height: int
+    sha256: str
+
+def image_file_name(image: str, extension: str = "png") -> str:
+    return os.path.basename(f"{image.split('.')[0]}.{extension}".replace(" ", ""))
+
+class ImageStore:
+    def __init__(self, images_dir: Path):
+        self.images_dir = images_dir
+        self.pack_path = None
+        self.manifest_path = images_dir / MANIFEST_NAME
+        self.manifest: Dict[str, ImageEntry] = {}
+        self.loose: Set[str] = set()
+        self.pack = None
+
+    def load(self):
+        self.close()
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported manifest version {manifest.get('version')}")
+            self.pack_path = self.images_dir / manifest["pack"]
+            with open(self.pack_path, "rb") as f:
+                # Offsets into any other pack would serve the wrong bytes.
+                size = os.fstat(f.fileno()).st_size
+                if size != manifest["pack_size"]:
+                    raise ValueError(f"{self.pack_path} is {size} bytes but its manifest expects {manifest['pack_size']}")
+                # An empty file cannot be mapped, but then there is nothing to serve either.
+                if size:
+                    self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logger.exception("Failed loading image pack, falling back to loose files")
+        else:
+            self.manifest = {name: ImageEntry(**entry) for name, entry in manifest["images"].items()}
+            unique = len({entry.offset for entry in self.manifest.values()})
+            logger.info("Mapped {} images ({} unique) from {}", len(self.manifest), unique, self.pack_path)
+            return
+
+        # No pack yet, so remember which loose files exist instead of probing the disk per embed.
+        try:
+            self.loose = {path.name for path in [*self.images_dir.glob("*.png"), *self.images_dir.glob("*.webp")]}
+        except OSError:
+            self.loose = set()
+
+    def close(self):
+        if self.pack is not None:
+            self.pack.close()
+        self.pack = None
+        self.manifest = {}
+        self.loose = set()
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.manifest or file_name in self.loose
+
+    def cache_key(self, file_name: str) -> str:
+        # Identical images share one uploaded URL whatever they are called.
+        entry = self.manifest.get(file_name)
+        return entry.sha256 if entry is not None else file_name
+
+    def has_image(self, image: str) -> bool:
+        return image_file_name(image) in self or image_file_name(image, "webp") in self
+
+    def open(self, file_name: str) -> discord.File:
+        entry = self.manifest.get(file_name)
+        if entry is not None:
+            # BytesIO adopts the sliced bytes without copying them again.
+            return discord.File(io.BytesIO(self.pack[entry.offset:entry.offset + entry.size]), filename=file_name)
+        return discord.File(self.images_dir / file_name.replace(" ", ""), filename=file_name)
+
+    def attach(self, embed: discord.Embed, image: str, thumbnail: bool = True) -> Optional[discord.File]:
+        # Prefer the small WebP variant the extractor writes next to each PNG.
+        file_name = image_file_name(image, "webp")
+        if not thumbnail or file_name not in self:
+            file_name = image_file_name(image)
+        if file_name not in self:
+            return None
+        embed.set_thumbnail(url=f"attachment://{file_name}")
+        return self.open(file_name)
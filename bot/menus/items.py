@@ -1,9 +1,10 @@
-from typing import List
-from pathlib import Path
+from typing import List, Optional
 
 import discord
 from discord import ui
 
+from .. import respond
+
 
 class ItemView(ui.View):
     def __init__(self, entries: List[discord.Embed], *, files: List[discord.File] = [], timeout: float | None = 180.0):
@@ -15,6 +16,8 @@ class ItemView(ui.View):
         else:
             self.files = []
         self.user = None
+        self.image_urls = None
+        self.images = None
         self.current_page = 1
         self.total_entries = len(self.entries)
 
@@ -32,7 +35,7 @@ class ItemView(ui.View):
         entry = self.entries[self.current_page - 1]
         return self.format_entry(entry)
     
-    def get_current_file(self) -> discord.Embed:
+    async def get_current_file(self) -> Optional[discord.File]:
         if not self.files:
             return None
         
@@ -40,26 +43,40 @@ class ItemView(ui.View):
         self.current_page = min(self.current_page, self.total_entries)
         self.current_page = max(self.current_page, 1)
 
-        # Return the formatted embed entry to display.
         file = self.files[self.current_page - 1]
-        if file:
-            file_name = file.filename.replace(" ", "")
-            file_path = Path("PNG_Images") / file_name
-            self.files[self.current_page - 1] = discord.File(file_path, filename=file.filename)
-        else:
-            self.files[self.current_page - 1] = None
+        if not file:
+            return None
+
+        # Prefer an image Discord already hosts over uploading the same bytes again.
+        entry = self.entries[self.current_page - 1]
+        if self.image_urls is not None:
+            url = await self.image_urls.resolve(file.filename, self.open_file)
+            if url is not None:
+                entry.set_thumbnail(url=url)
+                return None
 
-        return file
+        entry.set_thumbnail(url=f"attachment://{file.filename}")
+        return self.open_file(file.filename)
+
+    def open_file(self, file_name: str) -> discord.File:
+        # Files are consumed once sent, so always hand out a fresh one.
+        return self.images.open(file_name)
+
+    def remember_attachments(self, message: Optional[discord.Message]):
+        if self.image_urls is not None:
+            self.image_urls.remember(message)
 
     async def update(self, interaction: discord.Interaction):
         if self.files:
             file_list = []
-            if self.get_current_file():
-                file_list.append(self.get_current_file())
+            file = await self.get_current_file()
+            if file:
+                file_list.append(file)
 
-            await interaction.response.edit_message(
+            response = await interaction.response.edit_message(
                 embed=self.get_current_page(), view=self, attachments=file_list
             )
+            self.remember_attachments(getattr(response, "resource", None))
         else:
             await interaction.response.edit_message(
                 embed=self.get_current_page(), view=self
@@ -97,20 +114,17 @@ class ItemView(ui.View):
 
     async def start(self, interaction: discord.Interaction):
         self.user = interaction.user
+        self.image_urls = interaction.client.image_urls
+        self.images = interaction.client.images
+
+        file = await self.get_current_file()
+        kwargs = {"file": file} if file else {}
 
         # When we only have one embed to show, we don't need to paginate.
         if self.total_entries == 1:
-            if self.get_current_file():
-                await interaction.followup.send(embed=self.entries[0], file=self.files[0])
-
-            else:
-                await interaction.followup.send(embed=self.entries[0])
+            message = await respond.send(interaction, embed=self.entries[0], **kwargs)
+            self.remember_attachments(message)
 
         else:
-            if self.get_current_file():
-                await interaction.followup.send(embed=self.get_current_page(), view=self, file=self.get_current_file())
-                await self.wait()
-
-            else:
-                await interaction.followup.send(embed=self.get_current_page(), view=self)
-                await self.wait()
+            message = await respond.send(interaction, embed=self.get_current_page(), view=self, **kwargs)
+            self.remember_attachments(message)
@@ -0,0 +1,141 @@
+import sys
+from typing import Dict, Iterable, List, Optional
+
+def share(value):
+    # Intern strings so repeated values like schools and item types share one
+    # object across all records instead of one copy per row.
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+def text(value) -> Optional[str]:
+    # Object names and image paths come out of items.db as blobs. They are
+    # unique per record, so interning them would only grow the intern table.
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+class Record:
+    __slots__ = ()
+
+    def __reduce__(self):
+        # Pickle as a plain tuple of fields instead of a dict of slot names per record.
+        return self.__class__, tuple(getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.id} {self.real_name}>"
+
+# The from_row constructors take a SELECT * row of the record's table and the
+# locale strings it points at, and read columns at the positions the cogs always used.
+
+class ItemRecord(Record):
+    __slots__ = ("id", "name", "real_name", "image", "kind", "flags", "school", "level", "talent_req", "talent_req_rank")
+
+    def __init__(self, id, name, real_name, image, kind, flags, school, level, talent_req, talent_req_rank):
+        self.id = id
+        self.name = share(name)
+        self.real_name = text(real_name)
+        self.image = text(image)
+        self.kind = share(kind)
+        self.flags = flags
+        self.school = share(school)
+        self.level = level
+        self.talent_req = talent_req
+        self.talent_req_rank = talent_req_rank
+
+    @classmethod
+    def from_row(cls, row: tuple, locale: Dict[int, str]):
+        return cls(row[0], locale.get(row[1], ""), row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
+
+class PetRecord(Record):
+    __slots__ = ("id", "name", "real_name", "image", "strength", "agility", "will", "power", "guts", "guile", "grit", "health", "flags")
+
+    def __init__(self, id, name, real_name, image, strength, agility, will, power, guts, guile, grit, health, flags):
+        self.id = id
+        self.name = share(name)
+        self.real_name = text(real_name)
+        self.image = text(image)
+        self.strength = strength
+        self.agility = agility
+        self.will = will
+        self.power = power
+        self.guts = guts
+        self.guile = guile
+        self.grit = grit
+        self.health = health
+        self.flags = flags
+
+    @classmethod
+    def from_row(cls, row: tuple, locale: Dict[int, str]):
+        return cls(row[0], locale.get(row[1], ""), row[2], row[3], *row[4:13])
+
+class PowerRecord(Record):
+    __slots__ = ("id", "name", "real_name", "image", "description", "pvp_tag", "target_type", "target_area")
+
+    def __init__(self, id, name, real_name, image, description, pvp_tag, target_type, target_area):
+        self.id = id
+        self.name = share(name)
+        self.real_name = text(real_name)
+        self.image = text(image)
+        # Descriptions are long and only needed when rendering, so this stays a locale id.
+        self.description = description
+        self.pvp_tag = share(pvp_tag)
+        self.target_type = target_type
+        self.target_area = share(target_area)
+
+    @classmethod
+    def from_row(cls, row: tuple, locale: Dict[int, str]):
+        return cls(row[0], locale.get(row[1], ""), row[2], row[3], row[4], row[5], row[6], row[7])
+
+class TalentRecord(Record):
+    __slots__ = ("id", "name", "real_name", "image", "ranks")
+
+    def __init__(self, id, name, real_name, image, ranks):
+        self.id = id
+        self.name = share(name)
+        self.real_name = text(real_name)
+        self.image = text(image)
+        self.ranks = ranks
+
+    @classmethod
+    def from_row(cls, row: tuple, locale: Dict[int, str]):
+        return cls(row[0], locale.get(row[1], ""), row[2], row[3], row[4])
+
+class UnitRecord(Record):
+    __slots__ = (
+        "id", "name", "real_name", "image", "title", "gender", "faction", "school", "dmg_type",
+        "primary_stat", "curve", "primary_attack", "curve_powers", "random_name", "kind",
+    )
+
+    def __init__(self, id, name, real_name, image, title, gender, faction, school, dmg_type, primary_stat, curve, primary_attack, curve_powers, random_name, kind):
+        self.id = id
+        self.name = share(name)
+        self.real_name = text(real_name)
+        self.image = text(image)
+        self.title = share(title)
+        self.gender = share(gender)
+        self.faction = faction
+        self.school = share(school)
+        self.dmg_type = share(dmg_type)
+        self.primary_stat = primary_stat
+        self.curve = curve
+        self.primary_attack = primary_attack
+        self.curve_powers = curve_powers
+        self.random_name = random_name
+        self.kind = share(kind)
+
+    # The catalog selects units.kind by name after the other columns.
+    @classmethod
+    def from_row(cls, row: tuple, locale: Dict[int, str]):
+        return cls(
+            row[0], locale.get(row[1], ""), row[2], row[3], locale.get(row[4], ""), row[5], row[6], row[7], row[8],
+            row[9], row[10], row[12], row[13], row[14], row[-1],
+        )
+
+def find_records(records: Dict[int, Record], rows: Iterable[tuple]) -> List[Record]:
+    # Queries only pick out ids; the records themselves come from the catalog.
+    # Rows from a database swapped in after the catalog was read are skipped.
+    return [records[row[0]] for row in rows if row[0] in records]
+
+def record_names(records: Dict[int, Record]) -> List[str]:
+    return list(dict.fromkeys(record.name for record in records.values() if record.name))
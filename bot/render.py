@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord
+from loguru import logger
+
+from .bot import TheBot
+from .images import ImageStore
+from .search import Aliases, CorrectionMemo
+
+# Cogs whose embeds can be built in a render worker, by extension module.
+RENDER_COGS = {
+    "bot.extensions.items": "Items",
+    "bot.extensions.pets": "Pets",
+    "bot.extensions.powers": "Powers",
+    "bot.extensions.talents": "Talents",
+    "bot.extensions.units": "Units",
+}
+
+class WorkerBot:
+    # Holds only what the cogs read while building embeds, loaded the same way as TheBot.
+    load_db = TheBot.load_db
+
+    def __init__(self, db_path: Path, images_dir: Path, aliases_path: Path, corrections_path: Path):
+        self.db_path = db_path
+        self.db = None
+        self.scan_db = None
+        self.db_version = 0
+        self.catalog = None
+        self.search = None
+        self.aliases = Aliases(aliases_path)
+        self.aliases.load()
+        self.corrections = CorrectionMemo(corrections_path, reports=True)
+        self.retiring = set()
+        self.item_list = []
+        self.pet_list = []
+        self.power_list = []
+        self.talent_list = []
+        self.unit_list = []
+        self.render = None
+        self.images = ImageStore(images_dir)
+        self.images.load()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_bot: Optional[WorkerBot] = None
+_cogs: Dict[str, Any] = {}
+
+def init_worker(db_path: Path, images_dir: Path, aliases_path: Path, corrections_path: Path):
+    global _loop, _bot
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    bot = WorkerBot(db_path, images_dir, aliases_path, corrections_path)
+    _loop.run_until_complete(bot.load_db())
+    _bot = bot
+    for module, cog in RENDER_COGS.items():
+        _cogs[module] = getattr(import_module(module), cog)(bot)
+    # The database thread would otherwise keep the worker alive after the pool shuts down.
+    multiprocessing.util.Finalize(bot, close_worker, args=(bot,), exitpriority=10)
+
+def close_worker(bot: WorkerBot):
+    _loop.run_until_complete(bot.db.close())
+    _loop.run_until_complete(bot.scan_db.close())
+
+def render_in_worker(module: str, method: str, args: tuple) -> Tuple[List[Tuple[dict, Optional[str]]], tuple]:
+    # Embeds and files can't cross the process boundary, so send back plain
+    # dicts and attachment names for the bot to rebuild. Search counters and
+    # learned typo corrections ride along, so the bot's copies stay complete.
+    embeds = _loop.run_until_complete(getattr(_cogs[module], method)(*args))
+    report = (_bot.search.report(), _bot.corrections.report())
+    return [(embed.to_dict(), file.filename if file else None) for embed, file in embeds], report
+
+class RenderPool:
+    def __init__(self, db_path: Path, images: ImageStore, aliases: Aliases, corrections: CorrectionMemo, workers: int):
+        self.db_path = db_path
+        self.images = images
+        self.aliases = aliases
+        self.corrections = corrections
+        self.workers = workers
+        self.executor = None
+        self.rendered = 0
+        self.failed = 0
+
+    def start(self):
+        # Spawn rather than fork so workers never inherit the gateway connection or database threads.
+        self.executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.db_path, self.images.images_dir, self.aliases.path, self.corrections.path),
+        )
+        logger.info("Started {} render workers", self.workers)
+
+    def restart(self):
+        # Workers hold their own copy of the database, aliases and cog code, so replace them after any of those changes.
+        old_executor = self.executor
+        self.start()
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def can_render(self, method) -> bool:
+        return self.executor is not None and type(method.__self__).__module__ in RENDER_COGS
+
+    async def render(self, method, *args) -> List[Tuple[discord.Embed, Optional[discord.File]]]:
+        module = type(method.__self__).__module__
+        search = method.__self__.bot.search
+        try:
+            payload, (hits, corrections) = await asyncio.get_running_loop().run_in_executor(
+                self.executor, render_in_worker, module, method.__name__, args
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        self.rendered += 1
+        if search is not None:
+            search.merge(hits)
+        self.corrections.merge(corrections)
+        return [
+            (discord.Embed.from_dict(embed), self.images.open(file_name) if file_name else None)
+            for embed, file_name in payload
+        ]
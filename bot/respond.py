@@ -0,0 +1,33 @@
+import asyncio
+from typing import Optional
+
+import discord
+
+# Commands that answer within this long reply directly instead of deferring first.
+FAST_PATH_BUDGET = 1.0
+
+def ack_lock(interaction: discord.Interaction) -> asyncio.Lock:
+    # Deferring and replying race on the same interaction, so they take turns.
+    lock = interaction.extras.get("ack_lock")
+    if lock is None:
+        lock = interaction.extras["ack_lock"] = asyncio.Lock()
+    return lock
+
+async def defer(interaction: discord.Interaction):
+    async with ack_lock(interaction):
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+            interaction.extras["deferred"] = True
+
+async def send(interaction: discord.Interaction, **kwargs) -> Optional[discord.Message]:
+    # Reply in one round trip when nothing has acknowledged the interaction yet,
+    # otherwise follow up on the deferred response.
+    async with ack_lock(interaction):
+        if not interaction.response.is_done():
+            response = await interaction.response.send_message(**kwargs)
+            return response.resource
+    return await interaction.followup.send(**kwargs)
+
+async def defer_after(interaction: discord.Interaction, seconds: float = FAST_PATH_BUDGET):
+    await asyncio.sleep(seconds)
+    await defer(interaction)
@@ -0,0 +1,489 @@
+import asyncio
+import json
+import os
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from . import database
+from .budget import MAX_LIST_ROWS, QueryTooBroad
+from .catalog import Catalog
+from .records import Record
+
+# How many learned typo corrections are kept before the least recently used go.
+CORRECTION_LIMIT = 5000
+
+class Facets:
+    # Narrows a search to records whose fields equal some values, e.g. a
+    # school, and are at least some others, e.g. a level. The key is the
+    # values as the command received them, so results can be remembered per filter.
+    __slots__ = ("key", "equal", "at_least")
+
+    def __init__(self, key: tuple, equal: Dict[str, object], at_least: Dict[str, int]):
+        self.key = key
+        self.equal = equal
+        self.at_least = at_least
+
+def facets_key(facets: Optional[Facets]) -> tuple:
+    return () if facets is None else facets.key
+
+def item_facets(school: str, kind: str, level: int) -> Optional[Facets]:
+    if school == "All" and kind == "Any" and level == -1:
+        return None
+    equal = {}
+    if school != "All":
+        equal["school"] = school
+    if kind != "Any":
+        equal["kind"] = kind
+    return Facets((school, kind, level), equal, {"level": level} if level != -1 else {})
+
+def unit_facets(school: str, kind: str) -> Optional[Facets]:
+    if school == "Any" and kind == "Any":
+        return None
+    equal = {}
+    if school != "Any":
+        equal["school"] = school
+    if kind != "Any":
+        equal["kind"] = kind
+    return Facets((school, kind), equal, {})
+
+def talent_facets(ranks: int) -> Optional[Facets]:
+    if ranks == -1:
+        return None
+    return Facets((ranks,), {"ranks": ranks}, {})
+
+def facet_value(value):
+    # Filters used to compare with COLLATE NOCASE, so text values still do.
+    return value.casefold() if isinstance(value, str) else value
+
+def positions(mask: int) -> Iterator[int]:
+    # Set bits of a mask, lowest first. Scanning its binary string beats
+    # shifting a big int once per record.
+    bits = bin(mask)[:1:-1]
+    position = bits.find("1")
+    while position != -1:
+        yield position
+        position = bits.find("1", position + 1)
+
+# Anything that isn't a letter or digit, curly quotes and stray brackets included.
+PUNCTUATION = re.compile(r"[\W_]+")
+
+# Dropped outright rather than turned into spaces, so "samedi's" becomes "samedis".
+APOSTROPHES = str.maketrans("", "", "'`\u2018\u2019\u02bc")
+
+def normalize(name: str) -> str:
+    # "Samedi’s Standard", "samedis standard" and "SAMEDI'S  STANDARD" share
+    # one key. Accents are split off and dropped, then anything that isn't a
+    # letter or digit is removed.
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = name.translate(APOSTROPHES)
+    return " ".join(PUNCTUATION.sub(" ", name).split())
+
+class Aliases:
+    # Owner-maintained shorthand, e.g. {"items": {"bbs": "Big Black Sword"}}.
+    def __init__(self, path: Path):
+        self.path = path
+        self.aliases: Dict[str, Dict[str, str]] = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.aliases = json.load(f)
+        except FileNotFoundError:
+            self.aliases = {}
+        except (OSError, ValueError):
+            logger.exception("Failed loading aliases, starting without any")
+            self.aliases = {}
+
+    def save(self):
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.aliases, f, indent=4, ensure_ascii=False)
+        except OSError:
+            logger.exception("Failed saving aliases")
+
+    def set(self, kind: str, alias: str, name: Optional[str]):
+        # An empty name removes the alias.
+        entries = self.aliases.setdefault(kind, {})
+        alias = normalize(alias)
+        if name:
+            entries[alias] = name
+        else:
+            entries.pop(alias, None)
+        self.save()
+
+    def get(self, kind: str) -> Dict[str, str]:
+        return self.aliases.get(kind, {})
+
+class CorrectionMemo:
+    # Remembers which name a misspelt query fuzzy matched, so the next time
+    # someone makes the same typo it costs a dict lookup instead of scoring
+    # every name again. Corrections are only valid for the items.db they
+    # were learned from, so the file records its hash and is discarded
+    # when a different database is loaded.
+    #
+    # Only the bot process writes the file. Render workers load it, then
+    # hand what they learn and their counters back with each render, to be
+    # merged into the bot's memo.
+    def __init__(self, path: Path, limit: int = CORRECTION_LIMIT, reports: bool = False):
+        self.path = path
+        self.limit = limit
+        self.source_hash = None
+        self.corrections: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scans = 0
+        self.scan_time = 0.0
+        # Whether there are changes the file doesn't have yet.
+        self.dirty = False
+        # In a worker, what changed since the last report: learned corrections, forgotten keys and counters.
+        self.reports = reports
+        self.learned: List[Tuple[tuple, str]] = []
+        self.forgotten: List[tuple] = []
+        self.reported = (0, 0, 0, 0.0)
+
+    def load(self, source_hash: str):
+        # A reload of the same items.db picks up what was learned since the last write.
+        if self.dirty and not self.reports:
+            self.save()
+        self.source_hash = source_hash
+        self.corrections = OrderedDict()
+        self.dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.exception("Failed loading typo corrections, starting empty")
+            return
+        if data.get("source_hash") != source_hash:
+            logger.info("Discarding {} typo corrections learned from another items.db", len(data.get("corrections", [])))
+            return
+        # Stored oldest first, so the least recently used are evicted first again.
+        for kind, facets, query, name in data["corrections"][-self.limit:]:
+            self.corrections[(kind, tuple(facets), query)] = name
+
+    def snapshot(self) -> dict:
+        self.dirty = False
+        return {
+            "source_hash": self.source_hash,
+            "corrections": [[kind, list(facets), query, name] for (kind, facets, query), name in self.corrections.items()],
+        }
+
+    def write(self, data: dict):
+        # Written whole and swapped in, so a crash mid-write never leaves half a file.
+        temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError:
+            logger.exception("Failed saving typo corrections")
+
+    def save(self):
+        self.write(self.snapshot())
+
+    async def flush(self):
+        # Take the snapshot on the event loop, where the memo is changed, and write it off the loop.
+        if self.dirty:
+            await asyncio.to_thread(self.write, self.snapshot())
+
+    def get(self, key: tuple) -> Optional[str]:
+        name = self.corrections.get(key)
+        if name is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.corrections.move_to_end(key)
+        return name
+
+    def forget(self, key: tuple):
+        # The name is gone from the database, so the hit didn't actually save anything.
+        self.hits -= 1
+        self.misses += 1
+        self.drop(key)
+
+    def drop(self, key: tuple):
+        if self.corrections.pop(key, None) is not None:
+            self.dirty = True
+        if self.reports:
+            self.forgotten.append(key)
+
+    def remember(self, key: tuple, name: str, seconds: float):
+        self.scans += 1
+        self.scan_time += seconds
+        self.store(key, name)
+        if self.reports:
+            self.learned.append((key, name))
+
+    def store(self, key: tuple, name: str):
+        self.corrections[key] = name
+        self.corrections.move_to_end(key)
+        while len(self.corrections) > self.limit:
+            self.corrections.popitem(last=False)
+            self.evictions += 1
+        self.dirty = True
+
+    def report(self) -> tuple:
+        # Everything since the last report, for a worker to send back with its result.
+        counters = (self.hits, self.misses, self.scans, self.scan_time)
+        hits, misses, scans, scan_time = (now - before for now, before in zip(counters, self.reported))
+        report = (self.learned, self.forgotten, hits, misses, scans, scan_time)
+        self.learned, self.forgotten, self.reported = [], [], counters
+        return report
+
+    def merge(self, report: tuple):
+        learned, forgotten, hits, misses, scans, scan_time = report
+        for key in forgotten:
+            self.drop(key)
+        for key, name in learned:
+            self.store(key, name)
+        self.hits += hits
+        self.misses += misses
+        self.scans += scans
+        self.scan_time += scan_time
+
+    def saved_time(self) -> float:
+        # Each hit skipped one fuzzy scan, estimated at the average cost of the scans that ran.
+        if self.scans == 0:
+            return 0.0
+        return self.hits * self.scan_time / self.scans
+
+class EntityIndex:
+    # Filters are bitsets over the records in table order: bit i is set when
+    # record i has the value. Any combination of filters is then a few ANDs,
+    # and the result can be intersected with whatever else picks out records.
+    def __init__(self, records: Dict[int, Record], suffixes: Tuple[str, ...] = ("",), equal_fields: Tuple[str, ...] = (), range_fields: Tuple[str, ...] = ()):
+        self.records = list(records.values())
+        self.position = {record.id: position for position, record in enumerate(self.records)}
+        # Names that also answer a lookup for the bare name, e.g. mounts stored as "Name (PERM)".
+        self.suffixes = suffixes
+
+        self.bits: Dict[str, Dict[object, int]] = {field: {} for field in equal_fields}
+        for field, bits in self.bits.items():
+            for position, record in enumerate(self.records):
+                value = facet_value(getattr(record, field))
+                bits[value] = bits.get(value, 0) | (1 << position)
+
+        # For "at least" filters, the distinct values in order, each with the
+        # mask of every record at that value or above, found by bisecting.
+        self.ranges: Dict[str, Tuple[List[int], List[int]]] = {}
+        for field in range_fields:
+            bits = {}
+            for position, record in enumerate(self.records):
+                value = getattr(record, field)
+                if value is not None:
+                    bits[value] = bits.get(value, 0) | (1 << position)
+            values = sorted(bits)
+            masks = [0] * len(values)
+            above = 0
+            for i in reversed(range(len(values))):
+                above |= bits[values[i]]
+                masks[i] = above
+            self.ranges[field] = (values, masks)
+        self.by_name: Dict[str, List[Record]] = {}
+        self.by_real_name: Dict[str, List[Record]] = {}
+        for record in self.records:
+            if record.name:
+                self.by_name.setdefault(record.name.casefold(), []).append(record)
+            if record.real_name:
+                self.by_real_name.setdefault(record.real_name.casefold(), []).append(record)
+
+        # Most names are already their own key, so those share the by_name list.
+        self.by_key: Dict[str, List[Record]] = {}
+        for name, records in self.by_name.items():
+            key = normalize(name)
+            if key in self.by_key:
+                self.by_key[key] = self.by_key[key] + records
+            else:
+                self.by_key[key] = records
+        self.aliases: Dict[str, str] = {}
+
+    def set_aliases(self, aliases: Dict[str, str]):
+        self.aliases = {normalize(alias): normalize(name) for alias, name in aliases.items()}
+
+    def mask(self, facets: Optional[Facets]) -> Optional[int]:
+        # None stands for every record, so unfiltered lookups skip the masks entirely.
+        if facets is None:
+            return None
+        mask = (1 << len(self.records)) - 1
+        for field, value in facets.equal.items():
+            mask &= self.bits[field].get(facet_value(value), 0)
+        for field, minimum in facets.at_least.items():
+            values, masks = self.ranges[field]
+            i = bisect_left(values, minimum)
+            mask &= masks[i] if i < len(values) else 0
+        return mask
+
+    def filtered(self, records: List[Record], mask: Optional[int]) -> List[Record]:
+        if mask is None:
+            return list(records)
+        return [record for record in records if mask >> self.position[record.id] & 1]
+
+    def exact(self, name: str, mask: Optional[int]) -> List[Record]:
+        key = name.casefold()
+        for suffix in self.suffixes:
+            records = self.filtered(self.by_name.get(key + suffix.casefold(), []), mask)
+            if records:
+                return records
+        return []
+
+    def normalized(self, name: str, mask: Optional[int]) -> List[Record]:
+        key = normalize(name)
+        for suffix in self.suffixes:
+            records = self.filtered(self.by_key.get(normalize(key + suffix), []), mask)
+            if records:
+                return records
+        return []
+
+    def alias(self, name: str, mask: Optional[int]) -> List[Record]:
+        target = self.aliases.get(normalize(name))
+        if target is None:
+            return []
+        return self.normalized(target, mask)
+
+    def object_name(self, name: str) -> List[Record]:
+        return list(self.by_real_name.get(name.casefold(), []))
+
+    def masked(self, mask: Optional[int]) -> Iterable[Record]:
+        if mask is None:
+            return self.records
+        return (self.records[position] for position in positions(mask))
+
+    def names(self, mask: Optional[int] = None) -> Iterable[str]:
+        # Every distinct name once, in table order.
+        if mask is None:
+            return (records[0].name for records in self.by_name.values())
+        return dict.fromkeys(record.name for record in self.masked(mask) if record.name)
+
+def closest_name(name: str, names: Iterable[str]) -> Optional[str]:
+    # Ties go to whichever name came first, same as the sorted() the cogs used to do.
+    best, best_score = None, -1
+    for candidate in names:
+        score = database.fuzzy_score(name, candidate)
+        if score > best_score:
+            best, best_score = candidate, score
+    return best
+
+class SearchEngine:
+    # Resolves a name to records entirely from the catalog, trying each stage
+    # in turn: exact name, the name with case, accents and punctuation
+    # ignored, an owner-defined alias, a typo corrected before, then the
+    # closest fuzzy match among the records that pass the facets. Every
+    # stage but the last is a dict lookup.
+    def __init__(self, catalog: Catalog, aliases: Optional[Aliases] = None, corrections: Optional[CorrectionMemo] = None):
+        self.indexes = {
+            "items": EntityIndex(catalog.items, ("", " (PERM)"), ("school", "kind"), ("level",)),
+            "pets": EntityIndex(catalog.pets),
+            "powers": EntityIndex(catalog.powers),
+            "talents": EntityIndex(catalog.talents, equal_fields=("ranks",)),
+            "units": EntityIndex(catalog.units, equal_fields=("school", "kind")),
+        }
+        self.hits = {"exact": 0, "normalized": 0, "alias": 0, "corrected": 0, "object": 0, "fuzzy": 0, "miss": 0}
+        self.corrections = corrections
+        self.reported = dict(self.hits)
+        if aliases is not None:
+            self.set_aliases(aliases)
+
+    def set_aliases(self, aliases: Aliases):
+        for kind, index in self.indexes.items():
+            index.set_aliases(aliases.get(kind))
+
+    def find(self, kind: str, name: str, facets: Optional[Facets] = None, use_object_name: bool = False) -> Tuple[List[Record], str]:
+        index = self.indexes[kind]
+        if use_object_name:
+            records = index.object_name(name)
+            return self.hit(records, "object")
+
+        mask = index.mask(facets)
+        records = index.exact(name, mask)
+        if records:
+            return self.hit(records, "exact")
+
+        records = index.normalized(name, mask)
+        if records:
+            return self.hit(records, "normalized")
+
+        records = index.alias(name, mask)
+        if records:
+            return self.hit(records, "alias")
+
+        key = (kind, facets_key(facets), normalize(name))
+        match = self.corrected(key)
+        if match is not None:
+            records = index.filtered(index.by_name.get(match.casefold(), []), mask)
+            if records:
+                return self.hit(records, "corrected")
+            self.corrections.forget(key)
+
+        match = self.fuzzy(key, name, index.names(mask))
+        if match is None:
+            return self.hit([], "fuzzy")
+        return self.hit(index.filtered(index.by_name[match.casefold()], mask), "fuzzy")
+
+    def resolve(self, kind: str, name: str) -> List[Record]:
+        # Only stages that can't guess, for checking a name the owner typed in
+        # before trusting it. Not counted in the hit counters.
+        index = self.indexes[kind]
+        return index.exact(name, None) or index.normalized(name, None) or index.object_name(name)
+
+    def contains(self, kind: str, text: str, facets: Optional[Facets] = None, limit: int = MAX_LIST_ROWS) -> List[Record]:
+        # Records whose name contains the text, among those the facets allow.
+        text = text.lower()
+        records = [record for record in self.indexes[kind].masked(self.indexes[kind].mask(facets)) if record.name and text in record.name.lower()]
+        if len(records) > limit:
+            raise QueryTooBroad(f"More than {limit} results contain '{text}'")
+        return records
+
+    def restrict(self, kind: str, records: List[Record], facets: Optional[Facets] = None, limit: int = MAX_LIST_ROWS) -> List[Record]:
+        # Narrows records found some other way, e.g. by ability, to the facets.
+        index = self.indexes[kind]
+        records = index.filtered(records, index.mask(facets))
+        if len(records) > limit:
+            raise QueryTooBroad(f"More than {limit} rows matched")
+        return records
+
+    def closest(self, kinds: Iterable[str], name: str) -> Optional[str]:
+        kinds = tuple(kinds)
+        key = ("+".join(kinds), (), normalize(name))
+        match = self.corrected(key)
+        if match is not None and any(match.casefold() in self.indexes[kind].by_name for kind in kinds):
+            return match
+        if match is not None:
+            self.corrections.forget(key)
+        return self.fuzzy(key, name, (candidate for kind in kinds for candidate in self.indexes[kind].names()))
+
+    def corrected(self, key: tuple) -> Optional[str]:
+        if self.corrections is None:
+            return None
+        return self.corrections.get(key)
+
+    def fuzzy(self, key: tuple, name: str, names: Iterable[str]) -> Optional[str]:
+        start = time.perf_counter()
+        match = closest_name(name, names)
+        if match is not None and self.corrections is not None:
+            self.corrections.remember(key, match, time.perf_counter() - start)
+        return match
+
+    def report(self) -> Dict[str, int]:
+        # Hits since the last report, for a render worker to send back.
+        hits = {stage: count - self.reported[stage] for stage, count in self.hits.items()}
+        self.reported = dict(self.hits)
+        return hits
+
+    def merge(self, hits: Dict[str, int]):
+        for stage, count in hits.items():
+            self.hits[stage] += count
+
+    def hit(self, records: List[Record], stage: str) -> Tuple[List[Record], str]:
+        self.hits[stage if records else "miss"] += 1
+        return records, stage
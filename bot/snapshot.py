@@ -0,0 +1,113 @@
+import re
+from pathlib import Path
+from typing import Iterable, Set
+
+import aiosqlite
+from loguru import logger
+
+from .database import _fnv_1a
+
+# Every table a cog reads. Anything else in items.db (vdfs, which only
+# MoveImagesToBot.py needs, and whatever piratedb adds later) stays on disk.
+SNAPSHOT_TABLES = [
+    "curve_abilities",
+    "curve_points",
+    "factions",
+    "indiv_pet_powers",
+    "indiv_pet_talents",
+    "item_stats",
+    "items",
+    "pet_powers",
+    "pet_talents",
+    "pets",
+    "power_adjustments",
+    "power_info",
+    "powers",
+    "random_names",
+    "talent_ranks",
+    "talent_stats",
+    "talents",
+    "unit_stats",
+    "unit_tags",
+    "unit_talents",
+    "units",
+]
+
+INTEGER_TEXT = re.compile(r"-?\d+")
+
+def referenced_ids(values: Iterable) -> Set[int]:
+    # Locale ids are spread over many columns whose meaning isn't known here,
+    # so keep every integer the snapshot contains. A few stray numbers only
+    # cost a handful of extra strings.
+    ids = set()
+    for value in values:
+        if isinstance(value, int):
+            ids.add(value)
+        elif isinstance(value, str) and INTEGER_TEXT.fullmatch(value):
+            ids.add(int(value))
+    return ids
+
+def token_ids(text: str) -> Set[int]:
+    # Descriptions embed other strings as &key& and look them up by the key's hash.
+    return {_fnv_1a(token) for token in text.split("&")[1::2] if token}
+
+async def database_size(db: aiosqlite.Connection, schema: str = "main") -> int:
+    async with db.execute(f"PRAGMA {schema}.page_count") as cursor:
+        page_count = (await cursor.fetchone())[0]
+    async with db.execute(f"PRAGMA {schema}.page_size") as cursor:
+        page_size = (await cursor.fetchone())[0]
+    return page_count * page_size
+
+async def build_snapshot(db_path: Path) -> aiosqlite.Connection:
+    db = await aiosqlite.connect("file::memory:", uri=True)
+    await db.execute("ATTACH DATABASE ? AS source", (f"{db_path.resolve().as_uri()}?mode=ro",))
+
+    async with db.execute("SELECT type, name, tbl_name, sql FROM source.sqlite_master WHERE sql IS NOT NULL") as cursor:
+        schema = await cursor.fetchall()
+    tables = {name: sql for kind, name, _, sql in schema if kind == "table"}
+
+    # Copy the tables the cogs use as they are, so positional row access keeps working.
+    ids = set()
+    for table in SNAPSHOT_TABLES:
+        if table not in tables:
+            logger.warning("items.db has no {} table, leaving it out of the snapshot", table)
+            continue
+        await db.execute(tables[table])
+        await db.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table}")
+        async with db.execute(f"SELECT * FROM main.{table}") as cursor:
+            async for row in cursor:
+                ids |= referenced_ids(row)
+
+    # Then only the strings those rows point at, plus whatever those strings reference in turn.
+    await db.execute(tables["locale_en"])
+    await db.execute("CREATE TEMP TABLE wanted (id INTEGER PRIMARY KEY)")
+    while ids:
+        await db.execute("DELETE FROM temp.wanted")
+        await db.executemany("INSERT OR IGNORE INTO temp.wanted VALUES (?)", ((id,) for id in ids))
+        async with db.execute(
+            "SELECT * FROM source.locale_en WHERE id IN (SELECT id FROM temp.wanted) AND id NOT IN (SELECT id FROM main.locale_en)"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        await db.executemany("INSERT INTO main.locale_en VALUES (?, ?)", rows)
+        ids = set()
+        for _, data in rows:
+            if isinstance(data, str) and "&" in data:
+                ids |= token_ids(data)
+    await db.execute("DROP TABLE temp.wanted")
+
+    kept = set(SNAPSHOT_TABLES) | {"locale_en"}
+    for kind, name, table, sql in schema:
+        if kind == "index" and table in kept:
+            await db.execute(sql)
+    await db.commit()
+
+    source_size = await database_size(db, "source")
+    await db.execute("DETACH DATABASE source")
+    # Repack the copied pages densely now that nothing else will be written.
+    await db.execute("VACUUM")
+    snapshot_size = await database_size(db)
+    logger.info(
+        "Built pruned snapshot: {:.1f} MB from {:.1f} MB on disk ({:.0f}% smaller)",
+        snapshot_size / 1e6, source_size / 1e6, 100 - snapshot_size * 100 / max(source_size, 1),
+    )
+    return db
@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .records import ItemRecord
+
+# item_stats rows of these kinds add talents, powers and weapon types rather than numbers.
+NON_STAT_KINDS = ("Talent", "Power", "Weapon Type")
+
+class StatMatrix:
+    # Every item's stats as one row of a matrix with a column per stat, in
+    # catalog order, with each item's school, kind and level kept alongside.
+    # Ranking all items by a stat is then a few vectorized comparisons and
+    # a partial sort instead of a scan over item_stats.
+    def __init__(self, items: Dict[int, ItemRecord], rows: Iterable[tuple]):
+        # numpy is only imported once the catalog is compiled or loaded, not when the bot starts.
+        import numpy as np
+
+        self.ids = np.fromiter(items.keys(), dtype=np.int64, count=len(items))
+        position = {id: i for i, id in enumerate(items)}
+
+        totals: Dict[Tuple[int, str], float] = {}
+        # item_stats rows hold the item at 1, the kind at 2, the stat at 3 and the value at 4.
+        for row in rows:
+            item, kind, stat, value = row[1], row[2], row[3], row[4]
+            if kind not in NON_STAT_KINDS and item in position and isinstance(value, (int, float)):
+                key = (position[item], stat)
+                totals[key] = totals.get(key, 0) + value
+        self.stats = sorted({stat for _, stat in totals})
+        column = {stat: i for i, stat in enumerate(self.stats)}
+        self.values = np.zeros((len(self.ids), len(self.stats)), dtype=np.float32)
+        for (i, stat), value in totals.items():
+            self.values[i, column[stat]] = value
+
+        self.schools = sorted({item.school for item in items.values() if item.school})
+        self.kinds = sorted({item.kind for item in items.values() if item.kind})
+        self.school = np.array([self.code(self.schools, item.school) for item in items.values()], dtype=np.int16)
+        self.kind = np.array([self.code(self.kinds, item.kind) for item in items.values()], dtype=np.int16)
+        self.level = np.array([item.level or 0 for item in items.values()], dtype=np.int32)
+
+    @staticmethod
+    def code(values: List[str], value: Optional[str]) -> int:
+        # -1 never matches, for values no item has.
+        try:
+            return values.index(value)
+        except ValueError:
+            return -1
+
+    def top(self, stat: str, school: str = "All", kind: str = "Any", max_level: int = -1, count: int = 10) -> List[Tuple[int, float]]:
+        # The items raising the stat the most, best first, as (item id, value).
+        # A class also gets the items any class can use.
+        import numpy as np
+
+        values = self.values[:, self.stats.index(stat)]
+        mask = values > 0
+        if school == "Any":
+            mask &= self.school == self.code(self.schools, "Any")
+        elif school != "All":
+            mask &= (self.school == self.code(self.schools, school)) | (self.school == self.code(self.schools, "Any"))
+        if kind != "Any":
+            mask &= self.kind == self.code(self.kinds, kind)
+        if max_level != -1:
+            mask &= self.level <= max_level
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > count:
+            candidates = candidates[np.argpartition(-values[candidates], count - 1)[:count]]
+        # Equal values keep catalog order.
+        order = candidates[np.lexsort((candidates, -values[candidates]))]
+        return [(int(self.ids[i]), float(values[i])) for i in order]
+
+def format_stat(stat: str, value: float) -> str:
+    # Same as the item embeds: fractions and speed read as percentages.
+    if value < 1 or stat == "Speed":
+        return f"+{int(round(value, 2) * 100)}% {stat}"
+    if value.is_integer():
+        return f"+{int(value)} {stat}"
+    return f"+{round(value, 2)} {stat}"
@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+import discord
+from discord import app_commands
+from loguru import logger
+
+from .admission import AdmissionController, Overloaded, PRIORITY_INSTANT, command_priority
+from .budget import QueryTooBroad, SnapshotChanged
+from . import respond
+
+class AdmissionTree(app_commands.CommandTree):
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        self.admission = AdmissionController()
+        self.direct = 0
+        self.deferred = 0
+
+    async def _call(self, interaction: discord.Interaction):
+        # Autocomplete is cheap and can't be answered with a message anyway.
+        if interaction.type is not discord.InteractionType.application_command:
+            return await super()._call(interaction)
+
+        reason = self.admission.limit(interaction)
+        if reason is not None:
+            await self.reject(interaction, reason)
+            return
+
+        command = interaction.command
+        priority = command_priority(command.name if command else None)
+        if priority == PRIORITY_INSTANT:
+            return await super()._call(interaction)
+
+        # Give the command a moment to answer in a single round trip. If it is
+        # still queued or working once that runs out, defer so no amount of
+        # queued work can make it miss Discord's 3 second deadline.
+        deferral = asyncio.create_task(respond.defer_after(interaction))
+        try:
+            async with self.admission.slot(priority):
+                await super()._call(interaction)
+        except Overloaded:
+            logger.info("Rejected command from {}, too many commands waiting", interaction.user.name)
+            await self.reject(interaction, "Deacon is busy right now! Try again in a few seconds.")
+        finally:
+            if not deferral.done():
+                deferral.cancel()
+            elif deferral.exception() is not None:
+                logger.opt(exception=deferral.exception()).error("Failed to acknowledge command from {}", interaction.user.name)
+
+        if interaction.extras.get("deferred"):
+            self.deferred += 1
+        else:
+            self.direct += 1
+
+    def schema_hash(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        # Hash exactly what sync() would upload, so any change to a command shows up.
+        payload = [command.to_dict(self) for command in self.get_commands(guild=guild)]
+        payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, app_commands.CommandInvokeError) and isinstance(error.original, QueryTooBroad):
+            logger.info("Search from {} was too broad: {}", interaction.user.name, error.original)
+            await self.reject(interaction, "That search is too broad! Try again with a more specific keyword.")
+            return
+        if isinstance(error, app_commands.CommandInvokeError) and isinstance(error.original, SnapshotChanged):
+            logger.warning("items.db was written over while loaded, reload it with the db command")
+            await self.reject(interaction, "Deacon's database is being updated! Try again in a few minutes.")
+            return
+        await super().on_error(interaction, error)
+
+    async def reject(self, interaction: discord.Interaction, message: str):
+        try:
+            await respond.send(interaction, content=message, ephemeral=True)
+        except discord.HTTPException:
+            pass